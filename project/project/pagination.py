@@ -0,0 +1,97 @@
+"""Keyset (cursor) пагинация.
+
+Курсор - непрозрачная строка с значениями ключей сортировки последней строки страницы,
+следующая страница выбирается условием по этим ключам, а не смещением,
+поэтому глубокие страницы стоят столько же, сколько первая."""
+import base64
+import datetime
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+
+class PaginationError(ValueError):
+    pass
+
+
+def _default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError(f"Value of type {type(value).__name__} can not be used in a cursor")
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, default=_default).encode()).decode()
+
+
+def decode_cursor(cursor, length):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise PaginationError("Invalid cursor.")
+
+    if not isinstance(values, list) or len(values) != length:
+        raise PaginationError("Invalid cursor.")
+    # Курсор приходит от клиента: в условие по ключам попадают только скалярные значения
+    # (bool - для сортировки по булевым полям, например filter=have_size)
+    if not all(isinstance(value, (str, int, float, bool)) for value in values):
+        raise PaginationError("Invalid cursor.")
+    return values
+
+
+def is_paginated(request):
+    return "cursor" in request.GET or "limit" in request.GET
+
+
+def page_size(request):
+    limit = request.GET.get("limit")
+
+    if limit is None:
+        return DEFAULT_PAGE_SIZE
+    if not limit.isdigit() or int(limit) < 1:
+        raise PaginationError("Limit must be a positive integer.")
+    return min(int(limit), MAX_PAGE_SIZE)
+
+
+def keyset_filter(ordering, values):
+    """Условие "строго после" для ключей сортировки вида ["-created_date", "-id"]"""
+    condition = Q()
+    for i, field in enumerate(ordering):
+        name = field.lstrip("-")
+        step = Q(**{f"{name}__{'lt' if field.startswith('-') else 'gt'}": values[i]})
+        for prev_field, prev_value in zip(ordering[:i], values[:i]):
+            step &= Q(**{prev_field.lstrip("-"): prev_value})
+        condition |= step
+    return condition
+
+
+def _row_value(row, field):
+    value = row
+    for attr in field.lstrip("-").split("__"):
+        value = getattr(value, attr)
+    return value
+
+
+def paginate(queryset, ordering, request):
+    """Возвращает строки текущей страницы и курсор следующей (None на последней странице).
+    ordering должен заканчиваться уникальным полем, чтобы порядок был строгим"""
+    limit = page_size(request)
+    queryset = queryset.order_by(*ordering)
+
+    cursor = request.GET.get("cursor")
+    if cursor:
+        try:
+            queryset = queryset.filter(keyset_filter(ordering, decode_cursor(cursor, len(ordering))))
+        except (ValueError, TypeError, ValidationError):
+            raise PaginationError("Invalid cursor.")
+
+    rows = list(queryset[:limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    return rows, encode_cursor([_row_value(rows[-1], field) for field in ordering])
@@ -0,0 +1,138 @@
+"""Пакетное изменение корзины.
+
+Все операции проверяются по заранее загруженным позициям и типам товаров,
+после чего применяются в одной транзакции пачками insert/update/delete."""
+from django.db import transaction, IntegrityError
+from django.db.models import Q
+
+from .models import ProductItem, ProductCart
+from .sizes import size_registry
+
+MAX_OPERATIONS = 100
+MAX_COUNT = 10
+
+ADD = "add"
+LINE_ACTIONS = ("increment", "decrement", "remove")
+# Поля операций, по которым ищутся позиции и типы товаров
+FIELDS = ("productId", "type", "size", "id")
+
+
+class CartBatchError(ValueError):
+    pass
+
+
+def _parse(operations):
+    if not isinstance(operations, list) or not operations:
+        raise CartBatchError("Operations must be a non-empty list.")
+    if len(operations) > MAX_OPERATIONS:
+        raise CartBatchError(f"No more than {MAX_OPERATIONS} operations are allowed.")
+
+    for operation in operations:
+        if not isinstance(operation, dict) or operation.get("action") not in (ADD, *LINE_ACTIONS):
+            raise CartBatchError("Unavailable action")
+        # Списки и объекты нельзя использовать как ключи поиска
+        for field in FIELDS:
+            if not isinstance(operation.get(field), (str, int, type(None))):
+                raise CartBatchError(f"Invalid field: {field}.")
+
+
+def _load_items(operations):
+    """Типы товаров для операций add по ключу (productId, type) одним запросом"""
+    # Операции с нечисловым productId не найдут тип товара и получат ошибку при проверке
+    adds = [op for op in operations if op["action"] == ADD and str(op.get("productId")).isdigit()]
+    if not adds:
+        return {}
+
+    condition = Q()
+    for op in adds:
+        condition |= Q(product_id=int(op["productId"]), type=op.get("type"))
+
+    items = ProductItem.objects.select_related("product").prefetch_related("sizes").filter(condition)
+    return {(str(item.product_id), item.type): item for item in items}
+
+
+def apply_operations(user, operations):
+    """Применяет операции к корзине пользователя.
+    Возвращает список ошибок вида {"index", "error"}, при ошибках ничего не меняется"""
+    _parse(operations)
+
+    items = _load_items(operations)
+
+    try:
+        return _apply(user, operations, items)
+    except IntegrityError:
+        # Позицию добавили параллельным запросом между проверкой и вставкой
+        raise CartBatchError("Cart was changed by another request, try again.")
+
+
+def _apply(user, operations, items):
+    line_ids = [op.get("id") for op in operations if op["action"] in LINE_ACTIONS]
+
+    with transaction.atomic():
+        lines = {
+            line.id: line for line in user.productcart_set.select_for_update().filter(
+                Q(id__in=[i for i in line_ids if isinstance(i, int)])
+                | Q(product_item__in=list(items.values()))
+            )
+        }
+        # Позиции, которые уже есть в корзине, по товару и размеру
+        taken = {(line.product_item_id, line.size_id) for line in lines.values()}
+
+        counts = {line_id: line.count for line_id, line in lines.items()}
+        removed = set()
+        new_lines = []
+        errors = []
+
+        for index, op in enumerate(operations):
+            if op["action"] == ADD:
+                item = items.get((str(op.get("productId")), op.get("type")))
+                size = op.get("size")
+
+                if item is None:
+                    errors.append({"index": index, "error": "Desired product item does not exist."})
+                    continue
+                if item.product.have_size and size is None:
+                    errors.append({"index": index, "error": "Product must have the size."})
+                    continue
+                if not item.check_size(size):
+                    errors.append({"index": index, "error": "Product does not have this size."})
+                    continue
+
+                key = (item.id, size_registry.id(size) if item.product.have_size else None)
+                if key in taken:
+                    errors.append({"index": index, "error": "Product is already in the cart."})
+                    continue
+
+                taken.add(key)
+                new_lines.append(ProductCart(user=user, product_item=item, size_id=key[1]))
+                continue
+
+            line_id = op.get("id")
+            if line_id not in counts or line_id in removed:
+                errors.append({"index": index, "error": "Desired cart item does not exist."})
+            elif op["action"] == "increment":
+                if counts[line_id] >= MAX_COUNT:
+                    errors.append({"index": index, "error": "Count limit reached."})
+                else:
+                    counts[line_id] += 1
+            elif op["action"] == "decrement" and counts[line_id] > 1:
+                counts[line_id] -= 1
+            else:
+                removed.add(line_id)
+
+        if errors:
+            return errors
+
+        changed = [line for line_id, line in lines.items()
+                   if line_id not in removed and counts[line_id] != line.count]
+        for line in changed:
+            line.count = counts[line.id]
+
+        if removed:
+            ProductCart.objects.filter(id__in=removed).delete()
+        if changed:
+            ProductCart.objects.bulk_update(changed, ["count"])
+        if new_lines:
+            ProductCart.objects.bulk_create(new_lines)
+
+    return []
@@ -0,0 +1,202 @@
+"""Материализованный снимок каталога магазина.
+
+Для каждой темы хранится уже отрендеренный JSON листинга (для каждого варианта сортировки)
+и страниц товаров. Снимок целиком подменяется одной записью в кэше, поэтому читатели
+никогда не видят наполовину собранный каталог.
+
+Каждая запись снимка хранит ETag (хэш тела) и время последнего изменения,
+по ним условные GET-запросы получают 304 без обращения к базе и сериалайзерам.
+
+Каждое изменение товаров увеличивает версию каталога (см. version.py), снимок хранит версию,
+по которой построен. После коммита процесс, изменивший товары, пересобирает только их страницы,
+если снимок построен по предыдущей версии. Остальные процессы, в том числе с локальным кэшем
+(LocMemCache), пересобирают снимок при чтении, только когда версия в базе поменялась;
+неизменившиеся записи при этом сохраняют прежние ETag."""
+import functools
+import hashlib
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.renderers import JSONRenderer
+
+from . import version as catalog_version
+from .models import Product, ProductItem
+from .search import search_index
+from .serializers import ProductStoreSerializer, ProductPageSerializer
+
+SNAPSHOT_KEY = "store:catalog:{theme}"
+
+# Ключ сортировки -> аргумент order_by, пустой ключ - сортировка по умолчанию
+LISTING_ORDERINGS = {
+    "": None,
+    "name": "product__name",
+    "-name": "-product__name",
+    "price": "product__price",
+    "-price": "-product__price",
+}
+
+_rebuild_lock = threading.RLock()
+
+
+def listing_key(filter_, order_):
+    """Возвращает ключ сортировки снимка или None, если такой сортировки в снимке нет"""
+    if not filter_:
+        return ""
+    key = f"{'-' if order_ == 'desc' else ''}{filter_}"
+    return key if key in LISTING_ORDERINGS else None
+
+
+def _etag(value):
+    return f'"{hashlib.md5(value).hexdigest()}"'
+
+
+def _entry(data, previous=None):
+    """Запись снимка: тело, ETag и время изменения. Если тело не поменялось,
+    возвращается прежняя запись, чтобы не сбивать Last-Modified"""
+    body = JSONRenderer().render(data)
+    etag = _etag(body)
+    if previous is not None and previous["etag"] == etag:
+        return previous
+    return {"body": body, "etag": etag, "modified": int(time.time())}
+
+
+def build_listing(theme, previous=None):
+    previous = previous or {}
+    items = ProductItem.objects.for_store().filter(product__theme=theme, state=ProductItem.StateChoice.actual)
+    return {
+        key: _entry(ProductStoreSerializer(items.order_by(ordering) if ordering else items, many=True).data,
+                    previous.get(key))
+        for key, ordering in LISTING_ORDERINGS.items()
+    }
+
+
+def build_product_pages(theme, product_ids=None, previous=None):
+    previous = previous or {}
+    products = Product.objects.for_page().filter(theme=theme)
+    if product_ids is not None:
+        products = products.filter(id__in=product_ids)
+    return {product.id: _entry(ProductPageSerializer(product).data, previous.get(product.id)) for product in products}
+
+
+def rebuild(theme, product_ids=None, version=None):
+    """Пересобирает снимок темы и помечает его версией каталога version (по умолчанию - текущей).
+    Если переданы product_ids и снимок построен по версии version - 1, то есть кроме этих товаров
+    ничего не менялось, заново рендерятся только их страницы, остальные берутся из старого снимка"""
+    with _rebuild_lock:
+        if version is None:
+            version = catalog_version.current(refresh=True)
+
+        previous = cache.get(SNAPSHOT_KEY.format(theme=theme))
+
+        if previous is None:
+            previous = {"listing": {}, "products": {}}
+            # Без прежнего снимка частичная пересборка потеряла бы остальные товары темы
+            product_ids = None
+        elif previous.get("version") != version - 1:
+            # Снимок пропустил изменения других процессов
+            product_ids = None
+
+        if product_ids is None:
+            products = build_product_pages(theme, previous=previous["products"])
+        else:
+            products = {pk: entry for pk, entry in previous["products"].items() if pk not in product_ids}
+            products.update(build_product_pages(theme, product_ids, previous["products"]))
+
+        listing = build_listing(theme, previous["listing"])
+        entries = [*listing.values(), *(products[pk] for pk in sorted(products))]
+
+        snapshot = {
+            "listing": listing,
+            "products": products,
+            # Версия всего каталога темы, меняется при любом изменении листинга или страницы товара
+            "etag": _etag("".join(entry["etag"] for entry in entries).encode()),
+            "modified": max(entry["modified"] for entry in entries),
+            "version": version,
+        }
+        cache.set(SNAPSHOT_KEY.format(theme=theme), snapshot, None)
+        return snapshot
+
+
+def _is_current(snapshot, refresh=False):
+    return snapshot is not None and snapshot.get("version") == catalog_version.current(refresh)
+
+
+def get_snapshot(theme):
+    snapshot = cache.get(SNAPSHOT_KEY.format(theme=theme))
+    if _is_current(snapshot):
+        return snapshot
+
+    with _rebuild_lock:
+        # Пока ждали блокировку, снимок мог пересобрать другой поток
+        snapshot = cache.get(SNAPSHOT_KEY.format(theme=theme))
+        if not _is_current(snapshot, refresh=True):
+            snapshot = rebuild(theme)
+    return snapshot
+
+
+def find_product_page(pk):
+    """Ищет запись страницы товара во всех темах, возвращает (тема, запись) или (None, None)"""
+    for theme in Product.ThemeChoice.values:
+        entry = get_snapshot(theme)["products"].get(pk)
+        if entry is not None:
+            return theme, entry
+    return None, None
+
+
+def query_etag(snapshot, request):
+    """ETag для выдачи, которая собирается запросом к базе (пагинация, нестандартные сортировки):
+    зависит от версии каталога темы и параметров запроса"""
+    return _etag(f"{snapshot['etag']}{request.META.get('QUERY_STRING', '')}".encode())
+
+
+def not_modified(request, etag, modified):
+    """Возвращает ответ 304, если у клиента актуальная версия, иначе None"""
+    return get_conditional_response(request, etag=etag, last_modified=modified)
+
+
+def set_validators(response, etag, modified):
+    response.headers["ETag"] = etag
+    response.headers["Last-Modified"] = http_date(modified)
+    return response
+
+
+def _flush(product_ids, version):
+    """Пересборка после коммита транзакции, изменившей товары product_ids (None - неизвестно какие)
+    и поднявшей версию каталога до version"""
+    if product_ids is None:
+        search_index.invalidate()
+        for theme in Product.ThemeChoice.values:
+            rebuild(theme, version=version)
+        return
+
+    search_index.update_products(product_ids, version)
+
+    # Затрагиваются темы, к которым товары относятся сейчас и к которым относились в снимке
+    themes = set(Product.objects.filter(id__in=product_ids).values_list("theme", flat=True))
+    for theme in Product.ThemeChoice.values:
+        snapshot = cache.get(SNAPSHOT_KEY.format(theme=theme))
+        if snapshot is not None and product_ids & snapshot["products"].keys():
+            themes.add(theme)
+
+    for theme in Product.ThemeChoice.values:
+        if theme in themes:
+            rebuild(theme, product_ids, version)
+            continue
+
+        # Снимок темы, которую изменение не затронуло, остаётся верным и для новой версии
+        with _rebuild_lock:
+            snapshot = cache.get(SNAPSHOT_KEY.format(theme=theme))
+            if snapshot is not None and snapshot.get("version") == version - 1:
+                cache.set(SNAPSHOT_KEY.format(theme=theme), {**snapshot, "version": version}, None)
+
+
+def schedule_rebuild(product_ids=None):
+    """Поднимает версию каталога в текущей транзакции и планирует пересборку снимков после её коммита.
+    product_ids=None означает полную пересборку всех тем"""
+    version = catalog_version.bump()
+    product_ids = frozenset(product_ids) if product_ids is not None else None
+    transaction.on_commit(functools.partial(_flush, product_ids, version))
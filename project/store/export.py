@@ -0,0 +1,44 @@
+"""Выгрузка каталога в NDJSON для синхронизации с интранетом.
+
+Товары читаются порциями по id вместе с типами, размерами и фото,
+поэтому потребление памяти не зависит от размера каталога."""
+from rest_framework.renderers import JSONRenderer
+
+from .models import Product
+
+EXPORT_CHUNK_SIZE = 200
+
+
+def product_record(product):
+    return {
+        "id": product.id,
+        "name": product.name,
+        "price": product.price,
+        "description": product.description,
+        "have_size": product.have_size,
+        "theme": product.theme,
+        "created_date": product.created_date,
+        "items": [
+            {
+                "id": item.id,
+                "type": item.type,
+                "state": item.state,
+                "sizes": [size.size for size in item.sizes.all()],
+                "photos": item.photos(),
+            } for item in product.productitem_set.all()
+        ],
+    }
+
+
+def export_lines():
+    renderer = JSONRenderer()
+    last_id = 0
+
+    while True:
+        chunk = list(Product.objects.for_page().filter(id__gt=last_id).order_by("id")[:EXPORT_CHUNK_SIZE])
+        if not chunk:
+            return
+
+        for product in chunk:
+            yield renderer.render(product_record(product)) + b"\n"
+        last_id = chunk[-1].id
@@ -0,0 +1,105 @@
+"""Фильтры каталога и счётчики для боковой панели фильтров.
+
+Все счётчики считаются одним агрегирующим запросом. Счётчик каждого фильтра учитывает
+остальные выбранные фильтры, но не свой собственный, чтобы в панели было видно,
+сколько товаров появится при смене значения."""
+from django.db.models import Count, Exists, OuterRef, Q
+
+from .models import ProductItem
+from .sizes import size_registry
+
+FILTER_PARAMS = ("priceMin", "priceMax", "size", "haveSize")
+
+# Границы ценовых корзин [min, max), None - без верхней границы
+PRICE_BUCKETS = [(0, 100), (100, 200), (200, 500), (500, 1000), (1000, None)]
+
+
+class FilterError(ValueError):
+    pass
+
+
+def is_filtered(request):
+    return any(param in request.GET for param in FILTER_PARAMS)
+
+
+def parse_filters(request):
+    filters = {}
+
+    for param, key in (("priceMin", "price_min"), ("priceMax", "price_max")):
+        value = request.GET.get(param)
+        if value is None:
+            continue
+        if not value.isdigit():
+            raise FilterError(f"{param} must be a non-negative integer.")
+        filters[key] = int(value)
+
+    sizes = request.GET.getlist("size")
+    if sizes:
+        # Неизвестный размер не совпадает ни с одним товаром
+        filters["size_ids"] = [size_id for size in sizes if (size_id := size_registry.id(size)) is not None] or [0]
+
+    have_size = request.GET.get("haveSize")
+    if have_size is not None:
+        if have_size not in ("true", "false"):
+            raise FilterError("haveSize must be true or false.")
+        filters["have_size"] = have_size == "true"
+
+    return filters
+
+
+def _price_q(filters):
+    q = Q()
+    if "price_min" in filters:
+        q &= Q(product__price__gte=filters["price_min"])
+    if "price_max" in filters:
+        q &= Q(product__price__lte=filters["price_max"])
+    return q
+
+
+def _have_size_q(filters):
+    return Q(product__have_size=filters["have_size"]) if "have_size" in filters else Q()
+
+
+def _bucket_q(low, high):
+    return Q(product__price__gte=low) & (Q(product__price__lt=high) if high is not None else Q())
+
+
+def apply_filters(queryset, filters):
+    queryset = queryset.filter(_price_q(filters) & _have_size_q(filters))
+    if "size_ids" in filters:
+        # Exists, а не join по размерам, чтобы тип товара с несколькими подходящими размерами не дублировался
+        queryset = queryset.filter(Exists(ProductItem.sizes.through.objects.filter(
+            productitem_id=OuterRef("pk"), size_id__in=filters["size_ids"])))
+    return queryset
+
+
+def facet_counts(queryset, filters):
+    """queryset - товары темы без пользовательских фильтров"""
+    size_q = Q(sizes__id__in=filters["size_ids"]) if "size_ids" in filters else Q()
+    price_q, have_size_q = _price_q(filters), _have_size_q(filters)
+
+    def count(q):
+        return Count("id", distinct=True, filter=q or None)
+
+    sizes = size_registry.items()
+    aggregates = {"total": count(price_q & have_size_q & size_q)}
+    aggregates.update({
+        f"size_{size_id}": count(Q(sizes__id=size_id) & price_q & have_size_q) for size_id, _ in sizes
+    })
+    aggregates.update({
+        f"price_{i}": count(_bucket_q(low, high) & have_size_q & size_q) for i, (low, high) in enumerate(PRICE_BUCKETS)
+    })
+    aggregates.update({
+        f"have_size_{value}": count(Q(product__have_size=value) & price_q & size_q) for value in (True, False)
+    })
+
+    result = queryset.order_by().aggregate(**aggregates)
+
+    return {
+        "total": result["total"],
+        "sizes": {size: result[f"size_{size_id}"] for size_id, size in sizes},
+        "price": [
+            {"min": low, "max": high, "count": result[f"price_{i}"]} for i, (low, high) in enumerate(PRICE_BUCKETS)
+        ],
+        "haveSize": {"true": result["have_size_True"], "false": result["have_size_False"]},
+    }
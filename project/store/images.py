@@ -0,0 +1,87 @@
+"""Уменьшенные варианты фотографий товаров.
+
+Для каждого загруженного фото рядом с оригиналом сохраняются копии в WebP и JPEG
+для миниатюр, карточек магазина и страницы товара."""
+import logging
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+# Вариант -> максимальная сторона в пикселях
+VARIANTS = {
+    "thumbnail": 160,
+    "card": 480,
+    "full": 1280,
+}
+
+# Расширение -> формат Pillow
+FORMATS = {
+    "webp": "WEBP",
+    "jpeg": "JPEG",
+}
+
+
+def variant_name(name, variant, ext):
+    """images/productItemPhotos/hoodie.png -> images/productItemPhotos/hoodie_png_card.webp
+    Расширение оригинала входит в имя, чтобы варианты hoodie.png и hoodie.jpg не совпадали"""
+    stem, original_ext = os.path.splitext(name)
+    return f"{stem}_{original_ext.lstrip('.').lower()}_{variant}.{ext}"
+
+
+def variant_names(name):
+    return [variant_name(name, variant, ext) for variant in VARIANTS for ext in FORMATS]
+
+
+def _render(image, size, format_):
+    image = image.copy()
+    image.thumbnail((size, size), Image.LANCZOS)
+    if format_ == "JPEG" and image.mode != "RGB":
+        image = image.convert("RGB")
+
+    buffer = BytesIO()
+    image.save(buffer, format_, quality=85)
+    return buffer.getvalue()
+
+
+def generate_variants(photo_file):
+    """Сохраняет все варианты рядом с оригиналом, возвращает False, если оригинал не удалось прочитать"""
+    storage = photo_file.storage
+
+    try:
+        with photo_file.open("rb") as original:
+            image = ImageOps.exif_transpose(Image.open(original))
+            image.load()
+    except (OSError, UnidentifiedImageError) as err:
+        logger.warning("Can not generate variants for %s: %s", photo_file.name, err)
+        return False
+
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+
+    for variant, size in VARIANTS.items():
+        for ext, format_ in FORMATS.items():
+            name = variant_name(photo_file.name, variant, ext)
+            if storage.exists(name):
+                storage.delete(name)
+            storage.save(name, ContentFile(_render(image, size, format_)))
+    return True
+
+
+def delete_variants(storage, name):
+    """Удаляет варианты фото name, если они есть"""
+    for variant in variant_names(name):
+        if storage.exists(variant):
+            storage.delete(variant)
+
+
+def build_photo_variants(photo):
+    """Генерирует варианты для ProductPhoto и отмечает их готовность.
+    Флаг ставится через update, чтобы не вызывать повторно сигналы сохранения фото"""
+    if not generate_variants(photo.photo):
+        return False
+    type(photo).objects.filter(pk=photo.pk, photo=photo.photo.name).update(variants_ready=True)
+    return True
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from store import catalog
+from store.images import build_photo_variants
+from store.models import ProductPhoto
+
+
+class Command(BaseCommand):
+    help = "Генерирует уменьшенные варианты для уже загруженных фото товаров"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Пересоздать варианты и для уже обработанных фото")
+
+    def handle(self, *args, **options):
+        photos = ProductPhoto.objects.select_related("product_item").order_by("id")
+        if not options["all"]:
+            photos = photos.filter(variants_ready=False)
+
+        product_ids = set()
+        processed = failed = 0
+
+        for photo in photos.iterator():
+            if build_photo_variants(photo):
+                processed += 1
+                product_ids.add(photo.product_item.product_id)
+            else:
+                failed += 1
+                self.stderr.write(f"Не удалось обработать фото #{photo.id} ({photo.photo.name})")
+
+        if product_ids:
+            catalog.schedule_rebuild(product_ids)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Обработано фото: {processed}, ошибок: {failed}"))
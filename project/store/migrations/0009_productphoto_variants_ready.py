@@ -0,0 +1,18 @@
+# Generated by Django 4.1.1 on 2026-10-18 11:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0008_alter_productphoto_photo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productphoto',
+            name='variants_ready',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
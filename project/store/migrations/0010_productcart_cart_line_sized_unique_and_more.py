@@ -0,0 +1,37 @@
+# Generated by Django 4.1.1 on 2026-10-18 11:55
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_cart_lines(apps, schema_editor):
+    """Схлопывает повторяющиеся позиции корзины в одну, суммируя количество (не больше 10)"""
+    ProductCart = apps.get_model('store', 'ProductCart')
+
+    duplicates = ProductCart.objects.values('user_id', 'product_item_id', 'size_id') \
+        .annotate(lines=Count('id'), first_id=Min('id'), total=Sum('count')).filter(lines__gt=1)
+
+    for duplicate in duplicates:
+        ProductCart.objects.filter(id=duplicate['first_id']).update(count=min(duplicate['total'], 10))
+        ProductCart.objects.filter(
+            user_id=duplicate['user_id'], product_item_id=duplicate['product_item_id'], size_id=duplicate['size_id']
+        ).exclude(id=duplicate['first_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0009_productphoto_variants_ready'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_cart_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='productcart',
+            constraint=models.UniqueConstraint(condition=models.Q(('size__isnull', False)), fields=('user', 'product_item', 'size'), name='cart_line_sized_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='productcart',
+            constraint=models.UniqueConstraint(condition=models.Q(('size__isnull', True)), fields=('user', 'product_item'), name='cart_line_unsized_unique'),
+        ),
+    ]
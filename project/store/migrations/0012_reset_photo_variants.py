@@ -0,0 +1,18 @@
+from django.db import migrations
+
+
+def reset_variants(apps, schema_editor):
+    # Имена вариантов теперь включают расширение оригинала, старые файлы им не соответствуют;
+    # варианты пересоздаются командой generate_photo_variants
+    apps.get_model('store', 'ProductPhoto').objects.filter(variants_ready=True).update(variants_ready=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0011_catalogversion'),
+    ]
+
+    operations = [
+        migrations.RunPython(reset_variants, migrations.RunPython.noop),
+    ]
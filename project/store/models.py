@@ -2,8 +2,18 @@ from django.core.exceptions import ValidationError
 from django.db.models import Q
 from django.db import models
 from django.contrib.auth.models import User
-from django.db.models import UniqueConstraint, CheckConstraint
-import platform
+from django.db.models import UniqueConstraint, CheckConstraint, OuterRef, Subquery, Exists, F, Count, Sum
+from django.db.models.functions import Coalesce
+
+from .images import VARIANTS, FORMATS, variant_name
+from .sizes import size_registry
+
+
+class ProductQuerySet(models.QuerySet):
+    def for_page(self):
+        """Выборка для страницы товара: типы товара, их размеры и фото подгружаются
+        фиксированным числом запросов независимо от количества типов"""
+        return self.prefetch_related('productitem_set__sizes', 'productitem_set__productphoto_set')
 
 
 # Create your models here.
@@ -21,6 +31,8 @@ class Product(models.Model):
     theme = models.CharField(max_length=len(ThemeChoice.ussc), choices=ThemeChoice.choices,
                              default=ThemeChoice.ussc, null=False, blank=False, db_index=True)
 
+    objects = ProductQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Товар'
         verbose_name_plural = 'Товары'
@@ -36,13 +48,11 @@ class Product(models.Model):
                 'id': pi.id,
                 'type': pi.type,
                 'sizes': pi.size_list(),
-                'photos': pi.photos()
-            } for pi in self.productitem_set.filter(state=ProductItem.StateChoice.actual)
+                'photos': pi.photos(),
+                'photo_variants': pi.photos_variants()
+            } for pi in self.productitem_set.all() if pi.state == ProductItem.StateChoice.actual
         ]
 
-    def photo_list(self):
-        return [pi.photo() for pi in self.productitem_set.all()]
-
     def __str__(self):
         return self.name
 
@@ -58,6 +68,26 @@ class Size(models.Model):
         verbose_name_plural = 'Размеры'
 
 
+class ProductItemQuerySet(models.QuerySet):
+    def with_main_photo(self):
+        """Подтягивает имя файла главного фото одним подзапросом вместо запроса на каждую позицию"""
+        main_photo = ProductPhoto.objects.filter(product_item=OuterRef('pk')).order_by('-main', 'id')
+        return self.annotate(
+            main_photo=Subquery(main_photo.values('photo')[:1]),
+            main_photo_variants_ready=Subquery(main_photo.values('variants_ready')[:1]),
+        )
+
+    def with_size(self, size_id):
+        """Добавляет флаг has_size - есть ли у типа товара размер с переданным id"""
+        return self.annotate(has_size=Exists(
+            ProductItem.sizes.through.objects.filter(productitem_id=OuterRef('pk'), size_id=size_id)
+        ))
+
+    def for_store(self):
+        """Выборка для карточек магазина: товар через join, главное фото через подзапрос"""
+        return self.select_related('product').with_main_photo()
+
+
 class ProductItem(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     type = models.CharField(max_length=100, null=False, blank=False)
@@ -70,6 +100,8 @@ class ProductItem(models.Model):
     state = models.CharField(max_length=len(StateChoice.actual), choices=StateChoice.choices,
                              default=StateChoice.hidden, null=False, blank=False)
 
+    objects = ProductItemQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Тип товара'
         verbose_name_plural = 'Типы товаров'
@@ -82,20 +114,21 @@ class ProductItem(models.Model):
             raise ValidationError('Product can not be sized')
         if not self.check_size(size):
             raise ValidationError("Product does not have a specified size")
-        self.sizes.add(Size.objects.get(size=size))
-        self.save()
+        self.sizes.add(size_registry.id(size))
 
     def remove_size(self, size):
-        if not self.sizes.filter(size=size).exists():
+        size_id = size_registry.id(size)
+        if not self.has_size_id(size_id):
             raise ValidationError('Product does not have a specified size')
-        self.sizes.remove(Size.objects.get(size=size))
-        self.save()
+        self.sizes.remove(size_id)
+
+    def has_size_id(self, size_id):
+        return size_id is not None and size_id in {s.id for s in self.sizes.all()}
 
     def check_size(self, size: str):
         if not self.product.have_size:
             return size is None
-        size = Size.objects.get(size=size)
-        return size in self.sizes.all()
+        return self.has_size_id(size_registry.id(size))
 
     def size_list(self):
         if not self.product.have_size:
@@ -125,11 +158,21 @@ class ProductItem(models.Model):
         return self.product.theme
 
     def photo(self):
+        if hasattr(self, 'main_photo'):
+            return ProductPhoto.photo_path(self.main_photo) if self.main_photo else "Some photo path"
         return photo.path() if (photo := self.productphoto_set.first()) else "Some photo path"
 
+    def photo_variants(self):
+        if hasattr(self, 'main_photo'):
+            return ProductPhoto.variant_paths(self.main_photo) if self.main_photo_variants_ready else {}
+        return photo.variants() if (photo := self.productphoto_set.first()) else {}
+
     def photos(self):
         return [photo.path() for photo in self.productphoto_set.all()]
 
+    def photos_variants(self):
+        return [photo.variants() for photo in self.productphoto_set.all()]
+
     def __str__(self):
         return f"{self.product.name} - {self.type}"
 
@@ -139,6 +182,7 @@ class ProductPhoto(models.Model):
     product_item = models.ForeignKey(ProductItem, on_delete=models.CASCADE)
     photo = models.ImageField(upload_to="images/productItemPhotos/")
     main = models.BooleanField(default=False, null=False, blank=False)
+    variants_ready = models.BooleanField(default=False, null=False, blank=False, editable=False)
 
     class Meta:
         verbose_name = 'Фото цвета товара'
@@ -148,13 +192,42 @@ class ProductPhoto(models.Model):
             UniqueConstraint(fields=['product_item', ], condition=models.Q(main=True), name='photo_main_constrain')
         ]
 
+    @staticmethod
+    def photo_path(name):
+        return "/".join(name.replace("\\", "/").split("/")[-2:])
+
     def path(self):
-        return "/".join(self.photo.path.split("\\" if platform.system()== "Windows" else "/")[-2:])
+        return self.photo_path(self.photo.name)
+
+    @classmethod
+    def variant_paths(cls, name):
+        return {
+            variant: {ext: cls.photo_path(variant_name(name, variant, ext)) for ext in FORMATS}
+            for variant in VARIANTS
+        }
+
+    def variants(self):
+        """Пути уменьшенных копий фото, пустой словарь, пока они не сгенерированы"""
+        return self.variant_paths(self.photo.name) if self.variants_ready else {}
 
     def __str__(self):
         return f"{self.product_item.product.name} {self.product_item.type} - фото"
 
 
+class ProductCartQuerySet(models.QuerySet):
+    def for_display(self):
+        """Выборка для вывода корзины: тип товара и товар через join, фото одним дополнительным запросом"""
+        return self.select_related('product_item__product').prefetch_related('product_item__productphoto_set')
+
+    def summary(self):
+        """Число позиций, товаров и сумма корзины одним агрегирующим запросом"""
+        return self.aggregate(
+            lines=Coalesce(Count('id'), 0),
+            items=Coalesce(Sum('count'), 0),
+            total=Coalesce(Sum(F('count') * F('product_item__product__price')), 0),
+        )
+
+
 # Мб стоит переименовать просто в Cart
 class ProductCart(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -162,9 +235,18 @@ class ProductCart(models.Model):
     size = models.ForeignKey(Size, null=True, blank=True, default=None, on_delete=models.SET_NULL)
     count = models.PositiveSmallIntegerField(default=1)
 
+    objects = ProductCartQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Позиция в корзине'
         verbose_name_plural = 'Позиции в корзине'
+        constraints = [
+            # NULL в уникальных индексах не совпадает сам с собой, поэтому товары без размера - отдельным условием
+            UniqueConstraint(fields=['user', 'product_item', 'size'], condition=Q(size__isnull=False),
+                             name='cart_line_sized_unique'),
+            UniqueConstraint(fields=['user', 'product_item'], condition=Q(size__isnull=True),
+                             name='cart_line_unsized_unique'),
+        ]
 
     def name(self):
         return self.product_item.name()
@@ -173,7 +255,7 @@ class ProductCart(models.Model):
         return self.product_item.type
 
     def item_size(self):
-        return self.size.size if self.size else None
+        return size_registry.name(self.size_id) if self.size_id else None
 
     def price(self):
         return self.product_item.price()
@@ -187,14 +269,46 @@ class ProductCart(models.Model):
     def theme(self):
         return self.product_item.product.theme
 
+    def order_item(self):
+        """Позиция корзины в виде позиции заказа"""
+        return {
+            "product_id": self.product_id(),
+            "name": self.name(),
+            "type": self.type(),
+            "item_size": self.item_size(),
+            "photo": self.photo(),
+            "price": self.price(),
+            "count": self.count,
+            "theme": self.theme(),
+        }
+
     def change_count(self, action):
+        """Меняет количество одним условным UPDATE, чтобы одновременные клики не затирали друг друга.
+        Возвращает False, если позиция уже на пределе или удалена"""
+        line = ProductCart.objects.filter(id=self.id)
+
         if action == "add":
-            if self.count < 10:
+            if line.filter(count__lt=10).update(count=F('count') + 1):
                 self.count += 1
-                return self.save()
+                return True
+            return False
 
         if action == "remove":
-            if self.count == 1:
-                return self.delete()
-            self.count -= 1
-            return self.save()
+            if line.filter(count__gt=1).update(count=F('count') - 1):
+                self.count -= 1
+                return True
+            if line.filter(count__lte=1).delete()[0]:
+                self.id = None
+                return True
+            return False
+
+        return False
+
+
+class CatalogVersion(models.Model):
+    """Счётчик изменений каталога (одна строка), увеличивается в транзакции каждой записи товаров"""
+    version = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Версия каталога"
+        verbose_name_plural = "Версия каталога"
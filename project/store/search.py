@@ -0,0 +1,214 @@
+"""Полнотекстовый поиск по магазину.
+
+Индекс строится в памяти процесса по актуальным типам товаров (название и описание товара,
+название типа) при первом запросе и обновляется вместе со снимком каталога после изменения товаров.
+Поддерживаются поиск по префиксу и опечатки, время разбора запроса ограничено TIME_BUDGET.
+
+Индекс помнит версию каталога, по которой построен. Процесс, изменивший товары, обновляет
+только их документы; если версия в базе поменялась из-за других процессов, индекс перестраивается
+в фоновом потоке, а запросы до замены обслуживает прежний индекс."""
+import bisect
+import math
+import re
+import threading
+import time
+from collections import defaultdict
+
+from django.db import connection
+
+from . import version as catalog_version
+from .models import ProductItem
+
+# Вес совпадения в зависимости от поля
+FIELD_WEIGHTS = {
+    "name": 3.0,
+    "type": 2.0,
+    "description": 1.0,
+}
+
+# Вес совпадения в зависимости от способа
+EXACT_WEIGHT = 1.0
+PREFIX_WEIGHT = 0.7
+TYPO_WEIGHT = 0.4
+
+MAX_QUERY_TOKENS = 8
+MAX_EXPANSIONS = 30
+TIME_BUDGET = 0.05
+
+_token_re = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return _token_re.findall(text.lower().replace("ё", "е"))
+
+
+def _within_distance(a, b, max_distance):
+    """Проверяет, что расстояние Левенштейна между строками не больше max_distance"""
+    if abs(len(a) - len(b)) > max_distance:
+        return False
+
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > max_distance:
+            return False
+        previous = current
+    return previous[-1] <= max_distance
+
+
+def _max_typos(token):
+    if len(token) >= 8:
+        return 2
+    if len(token) >= 4:
+        return 1
+    return 0
+
+
+def _add(items, postings, documents):
+    for item in items:
+        weights = defaultdict(float)
+        for field, text in (("name", item.product.name), ("type", item.type),
+                            ("description", item.product.description)):
+            for token in tokenize(text):
+                weights[token] += FIELD_WEIGHTS[field]
+
+        for token, weight in weights.items():
+            postings[token][item.id] = weight
+        documents[item.id] = (item.product_id, item.product.theme, set(weights))
+
+
+class SearchIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._built = False
+        self._building = False
+        # Версия каталога, по которой построен индекс
+        self._version = None
+        # термин -> {id типа товара: вес}
+        self._postings = defaultdict(dict)
+        # id типа товара -> (id товара, тема, термины)
+        self._documents = {}
+        self._vocabulary = []
+
+    def _items(self):
+        return ProductItem.objects.select_related("product").filter(state=ProductItem.StateChoice.actual)
+
+    def _remove(self, item_id):
+        _, _, tokens = self._documents.pop(item_id)
+        for token in tokens:
+            self._postings[token].pop(item_id, None)
+            if not self._postings[token]:
+                del self._postings[token]
+
+    def _rebuild(self):
+        """Строит новый индекс без блокировки и подменяет им текущий"""
+        version = catalog_version.current(refresh=True)
+        postings, documents = defaultdict(dict), {}
+        _add(self._items(), postings, documents)
+        vocabulary = sorted(postings)
+
+        with self._lock:
+            # Пока строили, индекс мог обновиться изменениями более новой версии
+            if self._version is None or self._version <= version:
+                self._postings, self._documents, self._vocabulary = postings, documents, vocabulary
+                self._version = version
+            self._built = True
+
+    def _rebuild_in_background(self):
+        try:
+            self._rebuild()
+        finally:
+            with self._lock:
+                self._building = False
+            connection.close()
+
+    def _ensure_current(self):
+        if self._built and self._version == catalog_version.current():
+            return
+        if not self._built:
+            # Первый запрос процесса: отдавать пока нечего
+            self._rebuild()
+            return
+
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+        threading.Thread(target=self._rebuild_in_background, daemon=True).start()
+
+    def update_products(self, product_ids, version):
+        """Переиндексирует типы переданных товаров после изменения, поднявшего версию каталога до version.
+        Если индекс отстал больше чем на это изменение, он будет перестроен целиком при следующем поиске"""
+        with self._lock:
+            if not self._built or self._version != version - 1:
+                return
+            for item_id in [i for i, document in self._documents.items() if document[0] in product_ids]:
+                self._remove(item_id)
+            _add(self._items().filter(product_id__in=product_ids), self._postings, self._documents)
+            self._vocabulary = sorted(self._postings)
+            self._version = version
+
+    def invalidate(self):
+        """Помечает индекс устаревшим, до перестройки поиск идёт по прежнему"""
+        with self._lock:
+            self._version = None
+
+    def _expand(self, token, deadline):
+        """Термины словаря, подходящие под токен запроса, с весом способа совпадения"""
+        terms = {}
+        if token in self._postings:
+            terms[token] = EXACT_WEIGHT
+
+        start = bisect.bisect_left(self._vocabulary, token)
+        for term in self._vocabulary[start:start + MAX_EXPANSIONS]:
+            if not term.startswith(token):
+                break
+            terms.setdefault(term, PREFIX_WEIGHT)
+
+        max_typos = _max_typos(token)
+        if max_typos:
+            # Опечатки ищутся среди терминов с той же первой буквой, пока не кончится бюджет времени
+            start = bisect.bisect_left(self._vocabulary, token[0])
+            found = 0
+            for term in self._vocabulary[start:]:
+                if term[0] != token[0] or found >= MAX_EXPANSIONS or time.monotonic() > deadline:
+                    break
+                if term not in terms and _within_distance(token, term, max_typos):
+                    terms[term] = TYPO_WEIGHT
+                    found += 1
+        return terms
+
+    def search(self, query, theme):
+        """Возвращает id типов товаров темы, упорядоченные по релевантности"""
+        deadline = time.monotonic() + TIME_BUDGET
+        tokens = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TOKENS]
+
+        self._ensure_current()
+
+        with self._lock:
+            total = len(self._documents) or 1
+
+            scores = defaultdict(float)
+            matched = defaultdict(int)
+
+            for token in tokens:
+                best = {}
+                for term, match_weight in self._expand(token, deadline).items():
+                    postings = self._postings[term]
+                    idf = math.log(1 + total / len(postings))
+                    for item_id, weight in postings.items():
+                        if self._documents[item_id][1] != theme:
+                            continue
+                        best[item_id] = max(best.get(item_id, 0), match_weight * weight * idf)
+
+                for item_id, score in best.items():
+                    scores[item_id] += score
+                    matched[item_id] += 1
+
+        # Сначала документы, в которых нашлось больше слов запроса, затем по весу, затем новые
+        return sorted(scores, key=lambda item_id: (-matched[item_id], -scores[item_id], -item_id))
+
+
+search_index = SearchIndex()
@@ -9,19 +9,12 @@ class ProductPureSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class ProductCartPureSerializer(serializers.ModelSerializer):
-    """Сериалайзер для стандартной модели позиции корзины"""
-    class Meta:
-        model = ProductCart
-        fields = "__all__"
-
-
 class ProductStoreSerializer(serializers.ModelSerializer):
     """Сериалайзер для получения простой информации о типе товара
     для вывода карточек на странице магазина"""
     class Meta:
         model = ProductItem
-        fields = ('id', 'product_id', 'name', 'price', 'type', 'photo')
+        fields = ('id', 'product_id', 'name', 'price', 'type', 'photo', 'photo_variants')
 
 
 class ProductPageSerializer(serializers.ModelSerializer):
@@ -39,9 +32,3 @@ class CartStoreSerializer(serializers.ModelSerializer):
         model = ProductCart
         fields = ('id', 'product_id', 'name', 'type', 'theme',
                   'item_size', 'photo', 'count', 'price')
-
-
-class ProductSimpleSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Product
-        fields = ('id', 'name', 'price', 'photo_list')
@@ -0,0 +1,94 @@
+import threading
+
+from django.db import connection, transaction
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from . import catalog
+from .images import build_photo_variants, delete_variants
+from .models import Product, ProductItem, ProductPhoto, Size
+from .sizes import size_registry
+
+
+def _item_product_ids(item_ids):
+    return set(ProductItem.objects.filter(id__in=item_ids).values_list("product_id", flat=True))
+
+
+@receiver([post_save, post_delete], sender=Product)
+def product_changed(sender, instance, **kwargs):
+    catalog.schedule_rebuild({instance.id})
+
+
+@receiver([post_save, post_delete], sender=ProductItem)
+def product_item_changed(sender, instance, **kwargs):
+    catalog.schedule_rebuild({instance.product_id})
+
+
+def _build_variants_in_background(photo_id):
+    def run():
+        try:
+            photo = ProductPhoto.objects.select_related("product_item").filter(id=photo_id).first()
+            if photo is not None and build_photo_variants(photo):
+                catalog.schedule_rebuild({photo.product_item.product_id})
+        finally:
+            connection.close()
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def _delete_variants_on_commit(storage, name):
+    def run():
+        # Тот же файл может быть указан у другого фото
+        if not ProductPhoto.objects.filter(photo=name).exists():
+            delete_variants(storage, name)
+
+    transaction.on_commit(run)
+
+
+@receiver(pre_save, sender=ProductPhoto)
+def product_photo_uploaded(sender, instance, **kwargs):
+    previous = None
+    if not instance._state.adding:
+        previous = ProductPhoto.objects.filter(pk=instance.pk).values_list("photo", flat=True).first()
+
+    # Загружен новый файл или указан другой - старые варианты к нему не относятся
+    if not instance.photo._committed or previous != instance.photo.name:
+        instance.variants_ready = False
+        # Варианты прежнего файла удаляются после сохранения, когда фото на него уже не ссылается
+        instance._replaced_photo = previous
+
+
+@receiver([post_save, post_delete], sender=ProductPhoto)
+def product_photo_changed(sender, instance, **kwargs):
+    # При каскадном удалении тип товара может быть уже удалён, тогда пересобираем всё
+    product_ids = _item_product_ids([instance.product_item_id])
+    catalog.schedule_rebuild(product_ids or None)
+
+    if kwargs["signal"] is post_delete and instance.photo.name:
+        _delete_variants_on_commit(instance.photo.storage, instance.photo.name)
+    elif getattr(instance, "_replaced_photo", None):
+        _delete_variants_on_commit(instance.photo.storage, instance._replaced_photo)
+        instance._replaced_photo = None
+
+    if kwargs["signal"] is post_save and not instance.variants_ready:
+        photo_id = instance.id
+        transaction.on_commit(lambda: _build_variants_in_background(photo_id))
+
+
+@receiver([post_save, post_delete], sender=Size)
+def size_changed(sender, instance, **kwargs):
+    size_registry.invalidate()
+    catalog.schedule_rebuild()
+
+
+@receiver(m2m_changed, sender=ProductItem.sizes.through)
+def product_item_sizes_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+
+    if not reverse:
+        catalog.schedule_rebuild({instance.product_id})
+    elif pk_set:
+        catalog.schedule_rebuild(_item_product_ids(pk_set))
+    else:
+        catalog.schedule_rebuild()
@@ -0,0 +1,46 @@
+"""Реестр размеров в памяти процесса.
+
+Таблица Size почти не меняется, поэтому соответствие название <-> id загружается один раз
+и сбрасывается сигналами при изменении размеров. Раз в RELOAD_INTERVAL секунд реестр
+перечитывается, чтобы подхватить изменения, сделанные другими процессами."""
+import threading
+import time
+
+RELOAD_INTERVAL = 60
+
+
+class SizeRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tables = None
+        self._loaded_at = 0
+
+    def _get_tables(self):
+        tables = self._tables
+        if tables is not None and time.monotonic() - self._loaded_at < RELOAD_INTERVAL:
+            return tables
+
+        from .models import Size
+
+        with self._lock:
+            pairs = list(Size.objects.values_list("id", "size"))
+            self._tables = tables = (dict(pairs), {size: id_ for id_, size in pairs})
+            self._loaded_at = time.monotonic()
+        return tables
+
+    def id(self, size):
+        """id размера по названию или None, если такого размера нет"""
+        return self._get_tables()[1].get(size)
+
+    def name(self, size_id):
+        return self._get_tables()[0].get(size_id)
+
+    def items(self):
+        """Пары (id, название) всех размеров"""
+        return list(self._get_tables()[0].items())
+
+    def invalidate(self):
+        self._tables = None
+
+
+size_registry = SizeRegistry()
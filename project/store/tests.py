@@ -1,3 +1,143 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from . import catalog
+from . import version as catalog_version
+from .models import Product, ProductItem, ProductPhoto, Size
+from .serializers import ProductPageSerializer
+from .sizes import size_registry
+
 
 # Create your tests here.
+class ProductPageQueriesTest(TestCase):
+    def setUp(self):
+        self.sizes = [Size.objects.create(size=size) for size in ("S", "M", "L")]
+        self.product = Product.objects.create(name="Худи", price=300, theme=Product.ThemeChoice.udv, have_size=True)
+
+    def add_items(self, count):
+        for _ in range(count):
+            item = ProductItem.objects.create(product=self.product, type=f"Цвет {ProductItem.objects.count()}",
+                                              state=ProductItem.StateChoice.actual)
+            item.sizes.add(*self.sizes)
+            ProductPhoto.objects.create(product_item=item, photo=f"images/productItemPhotos/{item.id}.jpg", main=True)
+        ProductItem.objects.create(product=self.product, type="Скрытый", state=ProductItem.StateChoice.hidden)
+
+    def page(self):
+        return ProductPageSerializer(Product.objects.for_page().get(id=self.product.id)).data
+
+    def test_query_count_does_not_grow_with_items(self):
+        self.add_items(1)
+        with self.assertNumQueries(4):
+            self.page()
+
+        self.add_items(8)
+        with self.assertNumQueries(4):
+            self.page()
+
+    def test_json_matches_unprefetched_page(self):
+        self.add_items(3)
+        self.assertEqual(self.page(), ProductPageSerializer(Product.objects.get(id=self.product.id)).data)
+        self.assertEqual(len(self.page()["items_list"]), 3)
+
+
+class AddCartQueriesTest(TestCase):
+    def setUp(self):
+        size = Size.objects.create(size="M")
+        self.product = Product.objects.create(name="Худи", price=300, theme=Product.ThemeChoice.udv, have_size=True)
+        item = ProductItem.objects.create(product=self.product, type="Чёрный", state=ProductItem.StateChoice.actual)
+        item.sizes.add(size)
+        ProductPhoto.objects.create(product_item=item, photo="images/productItemPhotos/black.jpg", main=True)
+
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username="customer"))
+        # Реестр размеров загружается один раз на процесс и в запросе не участвует
+        size_registry.id("M")
+
+    def add_cart(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post("/store/cart/add/", {"productId": self.product.id, "type": "Чёрный", "size": "M"},
+                                        format="json")
+        # Точки сохранения вокруг вставки - управление транзакцией, а не чтение или запись
+        queries = [q["sql"] for q in context.captured_queries if "SAVEPOINT" not in q["sql"]]
+        return response, queries
+
+    def test_add_cart_uses_one_read_and_one_write(self):
+        response, queries = self.add_cart()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["item_size"], "M")
+        self.assertEqual(response.data["photo"], "productItemPhotos/black.jpg")
+        self.assertEqual(len(queries), 2)
+
+    def test_repeated_add_is_rejected_by_constraint(self):
+        self.add_cart()
+        response, queries = self.add_cart()
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(queries), 2)
+
+    def test_batch_rejects_non_scalar_fields(self):
+        for operation in ({"action": "add", "productId": self.product.id, "type": ["Чёрный"], "size": "M"},
+                          {"action": "add", "productId": self.product.id, "type": "Чёрный", "size": {"size": "M"}},
+                          {"action": "add", "productId": [self.product.id], "type": "Чёрный", "size": "M"},
+                          {"action": "remove", "id": [1]}):
+            response = self.client.post("/store/cart/batch/", {"operations": [operation]}, format="json")
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("Invalid field", response.data["error"])
+
+
+class CatalogSnapshotTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.products = [
+            Product.objects.create(name=name, price=100, theme=Product.ThemeChoice.udv) for name in ("Кружка", "Худи")
+        ]
+        for product in self.products:
+            ProductItem.objects.create(product=product, type="Белый", state=ProductItem.StateChoice.actual)
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_partial_rebuild_without_snapshot_builds_whole_theme(self):
+        edited, other = self.products
+        catalog.rebuild(Product.ThemeChoice.udv, {edited.id})
+
+        snapshot = cache.get(catalog.SNAPSHOT_KEY.format(theme=Product.ThemeChoice.udv))
+        self.assertEqual(set(snapshot["products"]), {edited.id, other.id})
+
+        response = APIClient().get(f"/store/products/{other.id}/", {"theme": Product.ThemeChoice.udv})
+        self.assertEqual(response.status_code, 200)
+
+    def test_stale_snapshot_is_rebuilt_on_read(self):
+        catalog.get_snapshot(Product.ThemeChoice.udv)
+        # Товар, изменённый другим процессом: пересборка в этом процессе не запускалась
+        with self.captureOnCommitCallbacks(execute=False):
+            added = Product.objects.create(name="Футболка", price=100, theme=Product.ThemeChoice.udv)
+
+        # Версия перечитывается не чаще раза в CHECK_INTERVAL секунд
+        self.assertNotIn(added.id, catalog.get_snapshot(Product.ThemeChoice.udv)["products"])
+
+        catalog_version.current(refresh=True)
+        self.assertIn(added.id, catalog.get_snapshot(Product.ThemeChoice.udv)["products"])
+
+    def test_each_commit_rebuilds_its_own_products(self):
+        edited, other = self.products
+        snapshot = catalog.get_snapshot(Product.ThemeChoice.udv)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            Product.objects.filter(id=edited.id).update(name="Кружка 2")
+            catalog.schedule_rebuild({edited.id})
+            Product.objects.filter(id=other.id).update(name="Худи 2")
+            catalog.schedule_rebuild({other.id})
+
+        for callback in callbacks:
+            callback()
+
+        rebuilt = cache.get(catalog.SNAPSHOT_KEY.format(theme=Product.ThemeChoice.udv))
+        self.assertEqual(rebuilt["version"], catalog_version.current(refresh=True))
+        for product in self.products:
+            self.assertNotEqual(rebuilt["products"][product.id]["etag"], snapshot["products"][product.id]["etag"])
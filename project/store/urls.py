@@ -1,12 +1,16 @@
 from django.urls import path
-from .views import get_products, get_product, get_cart, manage_cart, add_cart, get_product_test
+from .views import get_products, get_product, get_cart, manage_cart, add_cart, export_products, search_products, \
+    batch_cart, get_cart_summary
 
 
 urlpatterns = [
     path('products/', get_products),
+    path('search/', search_products),
     path('products/<str:pk>/', get_product),
     path('cart/', get_cart),
     path('cart/add/', add_cart),
+    path('cart/batch/', batch_cart),
+    path('cart/summary/', get_cart_summary),
     path('cart/<str:pk>/', manage_cart),
-    path("test/", get_product_test)
+    path("export/", export_products)
 ]
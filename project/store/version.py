@@ -0,0 +1,40 @@
+"""Версия каталога, общая для всех процессов.
+
+Каждое изменение товаров увеличивает счётчик CatalogVersion в своей транзакции. Снимок каталога
+и поисковый индекс запоминают версию, по которой построены, и перестраиваются, только когда
+версия в базе поменялась. Процесс перечитывает версию не чаще раза в CHECK_INTERVAL секунд."""
+import threading
+import time
+
+from django.db.models import F
+
+CHECK_INTERVAL = 5
+
+_lock = threading.Lock()
+_version = None
+_checked_at = 0
+
+
+def current(refresh=False):
+    global _version, _checked_at
+
+    if not refresh and _version is not None and time.monotonic() - _checked_at < CHECK_INTERVAL:
+        return _version
+
+    from .models import CatalogVersion
+
+    with _lock:
+        _version = CatalogVersion.objects.filter(id=1).values_list("version", flat=True).first() or 0
+        _checked_at = time.monotonic()
+        return _version
+
+
+def bump():
+    """Увеличивает версию в текущей транзакции и возвращает новую. Строка версии остаётся
+    заблокированной до коммита, поэтому версии одной транзакции идут подряд"""
+    from .models import CatalogVersion
+
+    if not CatalogVersion.objects.filter(id=1).update(version=F("version") + 1):
+        CatalogVersion.objects.get_or_create(id=1)
+        CatalogVersion.objects.filter(id=1).update(version=F("version") + 1)
+    return CatalogVersion.objects.filter(id=1).values_list("version", flat=True).get()
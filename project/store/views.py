@@ -1,12 +1,20 @@
 from django.core.exceptions import FieldError
+from django.db import transaction, IntegrityError
+from django.http import HttpResponse, StreamingHttpResponse
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
-from .serializers import ProductStoreSerializer, CartStoreSerializer, ProductPageSerializer, ProductCartPureSerializer, \
-    ProductSimpleSerializer
+from project.pagination import is_paginated, paginate, PaginationError, page_size, encode_cursor, decode_cursor
+from .serializers import ProductStoreSerializer, CartStoreSerializer
 
-from .models import Product, ProductItem
+from .cart import apply_operations, CartBatchError
+from .export import export_lines
+from .facets import is_filtered, parse_filters, apply_filters, facet_counts, FilterError
+from .models import ProductItem, ProductCart
+from .search import search_index
+from .sizes import size_registry
+from . import catalog
 
 
 @api_view(["GET"])
@@ -14,51 +22,136 @@ def get_products(request):
     """Метод выдаёт товары в магазин
     По дефолту упорядочивается по дате создания товаров
     filter - принимает значения name или price
-    order - принимает значениея desc или asc"""
+    order - принимает значениея desc или asc
+    cursor, limit - включают постраничную выдачу вида {"results": [...], "next": курсор}
+    priceMin, priceMax, size (можно несколько), haveSize - фильтры, вместе с ними или пагинацией
+    в ответ добавляются счётчики фильтров {"results": [...], "next": курсор, "facets": {...}}"""
     theme_ = request.GET.get('theme')
 
     if theme_ != "Udv" and theme_ != "Ussc":
         return Response({'error': f"Not valid theme"}, status=400)
 
-    products = ProductItem.objects.filter(product__theme=theme_, state="actual")
-
     filter_ = request.GET.get('filter', None)
     order_ = request.GET.get('order', None)
+    paginated = is_paginated(request) or is_filtered(request)
+
+    snapshot = catalog.get_snapshot(theme_)
+
+    # Стандартные сортировки отдаются из готового снимка каталога
+    key = catalog.listing_key(filter_, order_)
+    if key is not None and not paginated:
+        entry = snapshot["listing"][key]
+        return catalog.not_modified(request, entry["etag"], entry["modified"]) or catalog.set_validators(
+            HttpResponse(entry["body"], content_type="application/json"), entry["etag"], entry["modified"])
+
+    # Остальная выдача собирается запросом, но версионируется по снимку темы
+    etag = catalog.query_etag(snapshot, request)
+    response = catalog.not_modified(request, etag, snapshot["modified"])
+    if response is not None:
+        return response
+
+    try:
+        filters = parse_filters(request)
+    except FilterError as err:
+        return Response({"error": str(err)}, status=400)
+
+    theme_items = ProductItem.objects.filter(product__theme=theme_, state="actual")
+    products = apply_filters(theme_items.for_store(), filters)
+
+    ordering = ["-product__created_date", "-id"]
 
     if filter_:
+        sign = '-' if order_ == 'desc' else ''
         try:
-            products = products.order_by(f"{'-' if order_ == 'desc' else ''}product__{filter_}")
+            products = products.order_by(f"{sign}product__{filter_}")
+            ordering = [f"{sign}product__{filter_}", f"{sign}id"]
         except FieldError:
             pass
 
-    return Response(ProductStoreSerializer(products, many=True).data)
+    if not paginated:
+        response = Response(ProductStoreSerializer(products, many=True).data)
+        return catalog.set_validators(response, etag, snapshot["modified"])
+
+    try:
+        page, next_cursor = paginate(products, ordering, request)
+    except PaginationError as err:
+        return Response({"error": str(err)}, status=400)
+
+    response = Response({
+        "results": ProductStoreSerializer(page, many=True).data,
+        "next": next_cursor,
+        "facets": facet_counts(theme_items, filters),
+    })
+    return catalog.set_validators(response, etag, snapshot["modified"])
+
+
+@api_view(["GET"])
+def search_products(request):
+    """Поиск по названию, описанию товара и названию типа товара
+    q - строка поиска, theme - тема магазина
+    cursor, limit - постраничная выдача вида {"results": [...], "next": курсор}"""
+    theme_ = request.GET.get('theme')
+    query = request.GET.get('q', '').strip()
+
+    if theme_ != "Udv" and theme_ != "Ussc":
+        return Response({'error': "Not valid theme"}, status=400)
+
+    if not query or len(query) > 100:
+        return Response({'error': "Search query must contain from 1 to 100 characters."}, status=400)
+
+    try:
+        limit = page_size(request)
+        offset = decode_cursor(request.GET["cursor"], 1)[0] if request.GET.get("cursor") else 0
+    except PaginationError as err:
+        return Response({"error": str(err)}, status=400)
+
+    if not isinstance(offset, int) or offset < 0:
+        return Response({"error": "Invalid cursor."}, status=400)
+
+    ranked = search_index.search(query, theme_)
+    page_ids = ranked[offset:offset + limit]
+    items = ProductItem.objects.for_store().in_bulk(page_ids)
+
+    return Response({
+        "results": ProductStoreSerializer([items[i] for i in page_ids if i in items], many=True).data,
+        "next": encode_cursor([offset + limit]) if offset + limit < len(ranked) else None,
+    })
 
 
 @api_view(["GET"])
 def get_product(request, pk):
     """Метод возвращает всю необходимую информацию о товаре:
     ID, название, цена, описание и список всех связанных с ним типов товара"""
-    product = Product.objects.filter(id=pk).first()
     theme_ = request.GET.get("theme")
+    product_theme, entry = catalog.find_product_page(int(pk)) if pk.isdigit() else (None, None)
 
-    if product is None:
+    if entry is None:
         return Response({"error": f"Product with id {pk} does not exist."}, status=404)
 
-    if theme_ != product.theme:
+    if theme_ != product_theme:
         return Response(
             {
                 "error": "Product belongs to another theme, try with another theme.",
-                "theme": product.theme
+                "theme": product_theme
             }, status=400)
 
-    return Response(ProductPageSerializer(product, many=False).data)
+    return catalog.not_modified(request, entry["etag"], entry["modified"]) or catalog.set_validators(
+        HttpResponse(entry["body"], content_type="application/json"), entry["etag"], entry["modified"])
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_cart(request):
     """Метод возвращает необходимую информацию о товарах в корзине пользователя"""
-    return Response(CartStoreSerializer(request.user.productcart_set.all(), many=True).data)
+    return Response(CartStoreSerializer(request.user.productcart_set.for_display(), many=True).data)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_cart_summary(request):
+    """Метод возвращает краткую информацию о корзине для шапки сайта:
+    число позиций, число товаров и общую стоимость"""
+    return Response(request.user.productcart_set.summary())
 
 
 @api_view(["POST", "DELETE"])
@@ -66,7 +159,7 @@ def get_cart(request):
 def manage_cart(request, pk):
     """Метод позволяет авторизованному пользователю управлять корзиной:
     обновлять кол-во определенного товара или удалять позицию из своей корзины"""
-    cart_item = request.user.productcart_set.filter(id=pk).first()
+    cart_item = request.user.productcart_set.for_display().filter(id=pk).first()
 
     if cart_item is None:
         return Response({"error": "Desired cart item does not exist."}, status=400)
@@ -75,7 +168,10 @@ def manage_cart(request, pk):
         action = request.data.get("action")
         if action != "add" and action != "remove":
             return Response({"error": "Unavailable action"}, status=400)
-        cart_item.change_count(action)
+        if not cart_item.change_count(action):
+            if action == "add":
+                return Response({"error": "Cart item count limit reached."}, status=400)
+            return Response({"error": "Desired cart item does not exist."}, status=400)
 
     if request.method == "DELETE":
         cart_item.delete()
@@ -83,6 +179,23 @@ def manage_cart(request, pk):
     return Response(CartStoreSerializer(cart_item, many=False).data)
 
 
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def batch_cart(request):
+    """Метод применяет к корзине пользователя список операций в одной транзакции и возвращает корзину
+    operations - список вида {"action": "add", "productId", "type", "size"}
+    или {"action": "increment" | "decrement" | "remove", "id"}"""
+    try:
+        errors = apply_operations(request.user, request.data.get("operations"))
+    except CartBatchError as err:
+        return Response({"error": str(err)}, status=400)
+
+    if errors:
+        return Response({"errors": errors}, status=400)
+
+    return Response(CartStoreSerializer(request.user.productcart_set.for_display(), many=True).data)
+
+
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
 def add_cart(request):
@@ -91,8 +204,10 @@ def add_cart(request):
     type_ = request.data.get("type")
     size = request.data.get("size")
 
-    # Ищем доустпный товар с переданными параметрами
-    product_item = ProductItem.objects.filter(product_id=product_id, type=type_).first()
+    size_id = size_registry.id(size) if size is not None else None
+
+    # Ищем доступный товар с переданными параметрами сразу с товаром, главным фото и наличием размера
+    product_item = ProductItem.objects.for_store().with_size(size_id).filter(product_id=product_id, type=type_).first()
 
     # Если такого нет, то возвращаем ошибку
     if product_item is None:
@@ -103,29 +218,22 @@ def add_cart(request):
         return Response({"error": "Product must have the size."}, status=400)
 
     # Если товар не имеет переданного размера, то возвращаем ошибку
-    if not product_item.check_size(size):
+    if not (product_item.has_size if product_item.product.have_size else size is None):
         return Response({"error": "Product does not have this size."}, status=400)
 
-    # Проверяет, есть ли у пользователя данный товар в корзине, если есть, то возвращает ошибку
-    if product_item.product.have_size and \
-            request.user.productcart_set.filter(
-                product_item=product_item, size=product_item.sizes.get(size=size)
-            ).exists():
+    # Повторное добавление отсекается уникальным ограничением, а не отдельной проверкой
+    try:
+        with transaction.atomic():
+            cart_item = ProductCart.objects.create(user=request.user, product_item=product_item, size_id=size_id)
+    except IntegrityError:
         return Response({"error": "Product is already in the cart."}, status=400)
 
-    request.data['user'] = request.user.id
-    request.data['product_item'] = product_item.id
-    request.data['size'] = product_item.sizes.get(size=size).id if product_item.product.have_size else None
-
-    serializer = ProductCartPureSerializer(data=request.data)
-    if serializer.is_valid():
-        serializer.save()
-        return Response(
-            CartStoreSerializer(request.user.productcart_set.get(id=serializer.data.get("id")), many=False).data
-        )
-    return Response(serializer.errors, status=500)
+    # Все поля ответа уже загружены вместе с типом товара
+    return Response(CartStoreSerializer(cart_item, many=False).data)
 
 
 @api_view(["GET"])
-def get_product_test(request):
-    return Response(ProductSimpleSerializer(Product.objects.all(), many=True).data)
+def export_products(request):
+    """Метод выгружает все товары с типами, размерами и фото в формате NDJSON:
+    по одному товару в строке"""
+    return StreamingHttpResponse(export_lines(), content_type="application/x-ndjson")
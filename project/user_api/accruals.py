@@ -0,0 +1,109 @@
+"""Массовые начисления и списания юкоинов.
+
+Строки проверяются по заранее загруженным (и заблокированным) балансам пользователей,
+после чего записи истории создаются bulk_create, а балансы меняются одним UPDATE на пачку
+пользователей. Ошибочные строки пропускаются и попадают в отчёт, остальные применяются."""
+from django.db import connection, transaction
+from django.db.models import Case, When, F, IntegerField
+
+from .models import Customer, BalanceReplenish, BalanceWriteOff
+
+MAX_ROWS = 5000
+CHUNK_SIZE = 500
+
+
+class AccrualError(ValueError):
+    pass
+
+
+def _balance_limit():
+    """Наибольший баланс, который вмещает колонка, None - база не ограничивает"""
+    return connection.ops.integer_field_range(Customer._meta.get_field("balance").get_internal_type())[1]
+
+
+def _parse(rows):
+    if not isinstance(rows, list) or not rows:
+        raise AccrualError("Changes must be a non-empty list.")
+    if len(rows) > MAX_ROWS:
+        raise AccrualError(f"No more than {MAX_ROWS} changes are allowed.")
+
+    comment_max_length = BalanceReplenish._meta.get_field("comment").max_length
+    parsed, errors = [], {}
+
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            errors[index] = "Change must be an object."
+            continue
+
+        user_id, delta, comment = row.get("userId"), row.get("delta"), row.get("comment")
+
+        if not str(user_id).isdigit():
+            errors[index] = "User id must be integer field."
+        elif not isinstance(delta, int) or isinstance(delta, bool) or delta == 0:
+            errors[index] = "Delta must be a non-zero integer."
+        elif not isinstance(comment, str) or not comment or len(comment) > comment_max_length:
+            errors[index] = "Invalid field: comment."
+        else:
+            parsed.append((index, int(user_id), delta, comment))
+
+    return parsed, errors
+
+
+def _chunks(values):
+    values = list(values)
+    for i in range(0, len(values), CHUNK_SIZE):
+        yield values[i:i + CHUNK_SIZE]
+
+
+def apply_changes(admin, rows):
+    """Применяет строки вида {"userId", "delta", "comment"}.
+    Возвращает отчёт по каждой строке в порядке запроса: баланс после строки или ошибка"""
+    parsed, errors = _parse(rows)
+    limit = _balance_limit()
+
+    with transaction.atomic():
+        balances = {}
+        for chunk in _chunks({user_id for _, user_id, _, _ in parsed}):
+            balances.update(Customer.objects.select_for_update().filter(user_id__in=chunk)
+                            .values_list("user_id", "balance"))
+
+        start = dict(balances)
+        results = {}
+        ledger_replenish, ledger_write_off = [], []
+
+        # Строки применяются по порядку, списание проверяется по балансу с учётом предыдущих строк
+        for index, user_id, delta, comment in parsed:
+            balance = balances.get(user_id)
+            if balance is None:
+                errors[index] = "Desired user_id does not exist."
+            elif balance + delta < 0:
+                errors[index] = "Not enough ucoins"
+            elif limit is not None and balance + delta > limit:
+                errors[index] = "Balance limit exceeded."
+            else:
+                balances[user_id] = balance + delta
+                results[index] = (user_id, balance + delta)
+                model, ledger = (BalanceReplenish, ledger_replenish) if delta > 0 else \
+                    (BalanceWriteOff, ledger_write_off)
+                # bulk_create не вызывает save(), баланс меняется ниже одним UPDATE
+                ledger.append(model(user_id=user_id, admin_id=admin.id, count=abs(delta), comment=comment))
+
+        BalanceReplenish.objects.bulk_create(ledger_replenish, batch_size=CHUNK_SIZE)
+        BalanceWriteOff.objects.bulk_create(ledger_write_off, batch_size=CHUNK_SIZE)
+
+        deltas = {user_id: balances[user_id] - start[user_id] for user_id, _ in results.values()}
+        for chunk in _chunks(user_id for user_id, delta in deltas.items() if delta):
+            Customer.objects.filter(user_id__in=chunk).update(balance=Case(
+                *(When(user_id=user_id, then=F("balance") + deltas[user_id]) for user_id in chunk),
+                default=F("balance"),
+                output_field=IntegerField(),
+            ))
+
+    report = []
+    for index, row in enumerate(rows):
+        user_id = row.get("userId") if isinstance(row, dict) else None
+        if index in errors:
+            report.append({"index": index, "userId": user_id, "error": errors[index]})
+        else:
+            report.append({"index": index, "userId": user_id, "balance": results[index][1]})
+    return report
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Customer, Order
+from .models import Customer, Order, OrderLine
 
 
 # Register your models here.
@@ -8,6 +8,11 @@ class CustomerAdmin(admin.ModelAdmin):
     pass
 
 
+class OrderLineInline(admin.TabularInline):
+    model = OrderLine
+    extra = 0
+
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-    pass
+    inlines = (OrderLineInline, )
@@ -1,13 +1,16 @@
 from django.urls import path
 
-from .views import get_orders_admin, change_order_state, create_user, create_balance_changes, \
-    delete_user, change_user_permission, order_cancellation
+from .views import get_orders_admin, get_orders_by_office, change_order_state, change_orders_state, create_user, \
+    create_balance_changes, create_bulk_balance_changes, delete_user, change_user_permission, order_cancellation
 
 urlpatterns = [
     path("orders/", get_orders_admin),
+    path("orders/offices/", get_orders_by_office),
+    path("orders/state/", change_orders_state),
     path("order/cancellation/", order_cancellation),
     path("order/<str:pk>/", change_order_state),
     path("balance-changes/", create_balance_changes),
+    path("balance-changes/bulk/", create_bulk_balance_changes),
     path("user/", create_user),
     path("user/delete/<str:pk>/", delete_user),
     path("user/role/<str:pk>/", change_user_permission),
@@ -0,0 +1,56 @@
+"""Фильтры очереди заказов в админ панели"""
+import datetime
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import Order
+
+FILTER_PARAMS = ("office", "paymentMethod", "dateFrom", "dateTo")
+
+
+class FilterError(ValueError):
+    pass
+
+
+def _parse_date(params, param):
+    value = params.get(param)
+    if value is None:
+        return None
+    try:
+        date = parse_date(value) if isinstance(value, str) else None
+    except ValueError:
+        date = None
+    if date is None:
+        raise FilterError(f"{param} must be a date in YYYY-MM-DD format.")
+    return timezone.make_aware(datetime.datetime.combine(date, datetime.time.min))
+
+
+def parse_filters(params):
+    """params - request.GET или тело запроса"""
+    filters = {}
+
+    office = params.get("office")
+    if office is not None:
+        filters["office"] = office
+
+    payment_method = params.get("paymentMethod")
+    if payment_method is not None:
+        if payment_method not in Order.PaymentMethodChoice.values:
+            raise FilterError("Not valid payment method.")
+        filters["payment_method"] = payment_method
+
+    date_from = _parse_date(params, "dateFrom")
+    if date_from is not None:
+        filters["created_date__gte"] = date_from
+
+    # dateTo включает весь указанный день, сравнение с началом следующего дня сохраняет индекс по дате
+    date_to = _parse_date(params, "dateTo")
+    if date_to is not None:
+        filters["created_date__lt"] = date_to + datetime.timedelta(days=1)
+
+    return filters
+
+
+def apply_filters(queryset, filters):
+    return queryset.filter(**filters)
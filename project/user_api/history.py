@@ -0,0 +1,74 @@
+"""История изменений баланса пользователя.
+
+Пополнения и списания сливаются в одну ленту запросом UNION в базе. Лента упорядочена по
+(date, kind, id) от новых к старым, следующая страница выбирается курсором по этим ключам:
+для каждой таблицы условие "строго после курсора" упрощается, так как kind в ней постоянный."""
+from django.db import connection
+from django.db.models import Q, Value, CharField
+from django.utils.dateparse import parse_datetime
+
+from project.pagination import decode_cursor, encode_cursor, page_size, PaginationError
+from .models import BalanceReplenish, BalanceWriteOff
+
+REPLENISH = "replenish"
+WRITE_OFF = "write_off"
+
+ORDERING = ["-date", "-kind", "-id"]
+
+
+def _parse_date(value):
+    try:
+        date = parse_datetime(value) if isinstance(value, str) else None
+    except ValueError:
+        date = None
+    if date is None:
+        raise PaginationError("Invalid cursor.")
+    return date
+
+
+def _after(kind, cursor):
+    """Условие "строго после курсора" для таблицы, все строки которой имеют данный kind"""
+    date, cursor_kind, pk = cursor
+    if kind < cursor_kind:
+        return Q(date__lte=date)
+    if kind > cursor_kind:
+        return Q(date__lt=date)
+    return Q(date__lt=date) | Q(date=date, id__lt=pk)
+
+
+def _side(model, kind, user, cursor, limit):
+    rows = model.objects.filter(user=user) \
+        .annotate(kind=Value(kind, output_field=CharField())) \
+        .values("id", "kind", "count", "comment", "admin_id", "date")
+    if cursor is not None:
+        rows = rows.filter(_after(kind, cursor))
+    # Каждая сторона отдаёт не больше страницы по индексу (user, date), если база это поддерживает
+    if connection.features.supports_slicing_ordering_in_compound:
+        rows = rows.order_by(*ORDERING)[:limit]
+    return rows
+
+
+def balance_history(user, request):
+    """Возвращает страницу ленты и курсор следующей (None на последней странице)"""
+    limit = page_size(request)
+
+    cursor = request.GET.get("cursor")
+    if cursor:
+        cursor = decode_cursor(cursor, len(ORDERING))
+        if cursor[1] not in (REPLENISH, WRITE_OFF) or not isinstance(cursor[2], int):
+            raise PaginationError("Invalid cursor.")
+        cursor[0] = _parse_date(cursor[0])
+    else:
+        cursor = None
+
+    history = _side(BalanceReplenish, REPLENISH, user, cursor, limit + 1).union(
+        _side(BalanceWriteOff, WRITE_OFF, user, cursor, limit + 1), all=True)
+
+    rows = list(history.order_by(*ORDERING)[:limit + 1])
+
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor([last["date"], last["kind"], last["id"]])
@@ -0,0 +1,115 @@
+"""Идемпотентность запросов по заголовку Idempotency-Key.
+
+Первый запрос с ключом выполняется и его ответ сохраняется на KEY_TTL, повторы с тем же ключом
+получают сохранённый ответ. Повтор, пришедший пока первый запрос ещё выполняется, ждёт его ответа
+не дольше WAIT_TIMEOUT, а не выполняет операцию второй раз."""
+import functools
+import hashlib
+import json
+import time
+from datetime import timedelta
+
+from django.db import transaction, IntegrityError
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = "Idempotency-Key"
+REPLAY_HEADER = "Idempotent-Replayed"
+
+KEY_TTL = timedelta(hours=24)
+# Ключ, который так и остался "в процессе" (процесс упал), можно занять заново через это время
+STALE_AFTER = timedelta(minutes=5)
+WAIT_TIMEOUT = 10
+POLL_INTERVAL = 0.1
+
+
+def _fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(f"{request.method} {request.path} {body}".encode()).hexdigest()
+
+
+def _claim(request, key, fingerprint):
+    """Пытается занять ключ. Возвращает (запись, True), если запрос нужно выполнить,
+    или (запись, False), если ключ уже занят другим запросом"""
+    now = timezone.now()
+    # Просроченные ответы и зависшие запросы пользователя больше не держат свои ключи
+    IdempotencyKey.objects.filter(user=request.user).filter(
+        Q(state=IdempotencyKey.StateChoice.completed, created__lt=now - KEY_TTL)
+        | Q(state=IdempotencyKey.StateChoice.in_progress, created__lt=now - STALE_AFTER)
+    ).delete()
+
+    try:
+        with transaction.atomic():
+            record = IdempotencyKey.objects.create(user=request.user, key=key, path=request.path,
+                                                   fingerprint=fingerprint)
+        return record, True
+    except IntegrityError:
+        return IdempotencyKey.objects.filter(user=request.user, key=key).first(), False
+
+
+def _replay(record):
+    data, status = record.response()
+    response = Response(data, status=status)
+    response.headers[REPLAY_HEADER] = "true"
+    return response
+
+
+def idempotent(view):
+    """Декоратор для view, ставится под api_view и permission_classes.
+    Запросы без заголовка Idempotency-Key выполняются как обычно"""
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return view(request, *args, **kwargs)
+
+        if not key or len(key) > IdempotencyKey._meta.get_field("key").max_length:
+            return Response({"error": "Invalid Idempotency-Key header."}, status=400)
+
+        fingerprint = _fingerprint(request)
+        deadline = time.monotonic() + WAIT_TIMEOUT
+
+        while True:
+            record, owner = _claim(request, key, fingerprint)
+            if owner:
+                break
+
+            # Запись удалили между вставкой и чтением (первый запрос упал), пробуем занять ключ ещё раз
+            if record is None:
+                continue
+
+            if record.fingerprint != fingerprint:
+                return Response({"error": "Idempotency-Key was already used with another request."}, status=422)
+
+            # Ждёт, пока первый запрос не сохранит ответ или не освободит ключ
+            while record is not None and record.state == IdempotencyKey.StateChoice.in_progress:
+                if time.monotonic() > deadline:
+                    return Response({"error": "A request with this Idempotency-Key is still in progress."},
+                                    status=409)
+                time.sleep(POLL_INTERVAL)
+                record = IdempotencyKey.objects.filter(id=record.id).first()
+
+            if record is not None:
+                return _replay(record)
+
+        try:
+            # Ответ сохраняется в той же транзакции, что и изменения view,
+            # поэтому не бывает выполненной операции без сохранённого ответа
+            with transaction.atomic():
+                response = view(request, *args, **kwargs)
+                if response.status_code < 500:
+                    record.complete(response)
+        except Exception:
+            record.delete()
+            raise
+
+        # Ошибки сервера не сохраняются, запрос можно повторить с тем же ключом
+        if response.status_code >= 500:
+            record.delete()
+        return response
+
+    return wrapper
@@ -0,0 +1,74 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from user_api import reconciliation
+from user_api.models import Customer
+
+
+class Command(BaseCommand):
+    help = "Сверяет балансы покупателей с историей пополнений и списаний"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true",
+                            help="Пересчитать итоги истории с нуля, а не с контрольной точки")
+        parser.add_argument("--repair", action="store_true", help="Исправить расходящиеся балансы по истории")
+        parser.add_argument("--seed-opening-balances", action="store_true",
+                            help="Записать в историю разницу между балансом и историей (начальный баланс)")
+        parser.add_argument("--admin", type=int,
+                            help="ID администратора, от имени которого записывается начальный баланс")
+        parser.add_argument("--dry-run", action="store_true",
+                            help="Только показать записи начального баланса, ничего не записывая")
+
+    def handle(self, *args, **options):
+        if options["repair"] and options["seed_opening_balances"]:
+            raise CommandError("--repair и --seed-opening-balances исправляют расхождения в разные стороны, "
+                               "укажите один из них")
+        if options["seed_opening_balances"] and not options["dry_run"]:
+            if options["admin"] is None:
+                raise CommandError("Для --seed-opening-balances укажите --admin")
+            if not Customer.objects.filter(user_id=options["admin"], admin_permissions=True).exists():
+                raise CommandError(f"Пользователь #{options['admin']} не является администратором")
+
+        changed, replenish_upper, write_off_upper = reconciliation.advance(full=options["full"])
+        self.stdout.write(f"Обновлены итоги истории пользователей: {changed}")
+
+        rows = reconciliation.mismatches(replenish_upper, write_off_upper)
+        for user_id, balance, ledger in rows:
+            if ledger is None:
+                self.stdout.write(f"Пользователь #{user_id}: баланс {balance}, записей истории нет")
+            else:
+                self.stdout.write(f"Пользователь #{user_id}: баланс {balance}, по истории {ledger}")
+
+        if options["seed_opening_balances"]:
+            return self.seed_opening_balances(rows, options, replenish_upper, write_off_upper)
+
+        if not options["repair"]:
+            self.stdout.write(self.style.SUCCESS(f"Расхождений: {len(rows)}"))
+            return
+
+        repaired = reconciliation.repair(rows, replenish_upper, write_off_upper)
+        for user_id, _, total in rows:
+            if total is None:
+                self.stderr.write(f"Пользователь #{user_id}: нет записей истории, баланс не исправлен")
+            elif total < 0:
+                self.stderr.write(f"Пользователь #{user_id}: итог истории {total} отрицательный, баланс не исправлен")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Расхождений: {len(rows)}, исправлено: {len(repaired)}"))
+
+    def seed_opening_balances(self, rows, options, replenish_upper, write_off_upper):
+        if options["dry_run"]:
+            for user_id, balance, total in rows:
+                self.stdout.write(f"Пользователь #{user_id}: будет записан начальный баланс {balance - (total or 0)}")
+            self.stdout.write(self.style.SUCCESS(f"Расхождений: {len(rows)}, ничего не записано (--dry-run)"))
+            return
+
+        seeded = reconciliation.seed_opening_balances(rows, options["admin"], replenish_upper, write_off_upper)
+        for user_id, diff in seeded:
+            self.stdout.write(f"Пользователь #{user_id}: записан начальный баланс {diff}")
+
+        skipped = {user_id for user_id, _, _ in rows} - {user_id for user_id, _ in seeded}
+        for user_id in sorted(skipped):
+            self.stderr.write(f"Пользователь #{user_id}: баланс изменился во время сверки, начальный баланс не записан")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Расхождений: {len(rows)}, записано начальных балансов: {len(seeded)}"))
@@ -0,0 +1,40 @@
+# Generated by Django 4.1.1 on 2026-10-18 11:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0010_productcart_cart_line_sized_unique_and_more'),
+        ('user_api', '0015_alter_order_state_balancewriteoff'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.PositiveIntegerField(default=0, help_text='Сумма заказа на момент оформления.'),
+        ),
+        migrations.CreateModel(
+            name='OrderLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+                ('type', models.CharField(max_length=100)),
+                ('item_size', models.CharField(blank=True, default=None, max_length=5, null=True)),
+                ('photo', models.CharField(blank=True, default='', max_length=255)),
+                ('price', models.PositiveIntegerField()),
+                ('count', models.PositiveSmallIntegerField()),
+                ('theme', models.CharField(max_length=4)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='user_api.order')),
+                ('product', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='store.product')),
+            ],
+            options={
+                'verbose_name': 'Позиция заказа',
+                'verbose_name_plural': 'Позиции заказов',
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+import json
+
+from django.db import migrations
+
+CHUNK_SIZE = 500
+
+
+def fill_order_lines(apps, schema_editor):
+    """Переносит позиции заказов из JSON в product_list в таблицу OrderLine и считает сумму заказа"""
+    Order = apps.get_model('user_api', 'Order')
+    OrderLine = apps.get_model('user_api', 'OrderLine')
+
+    last_id = 0
+    while True:
+        orders = list(Order.objects.filter(id__gt=last_id, orderline__isnull=True).order_by('id')[:CHUNK_SIZE])
+        if not orders:
+            return
+
+        lines = []
+        for order in orders:
+            items = json.loads(bytes(order.product_list) or b"[]")
+            order.total = sum(item.get("count", 0) * item.get("price", 0) for item in items)
+            lines.extend(OrderLine(
+                order=order,
+                product_id=item.get("product_id"),
+                name=item.get("name", ""),
+                type=item.get("type", ""),
+                item_size=item.get("item_size"),
+                photo=item.get("photo", ""),
+                price=item.get("price", 0),
+                count=item.get("count", 0),
+                theme=item.get("theme", ""),
+            ) for item in items)
+
+        OrderLine.objects.bulk_create(lines)
+        Order.objects.bulk_update(orders, ['total'])
+        last_id = orders[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_api', '0016_order_total_orderline'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_order_lines, migrations.RunPython.noop),
+    ]
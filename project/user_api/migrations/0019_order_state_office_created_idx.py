@@ -0,0 +1,17 @@
+# Generated by Django 4.1.1 on 2026-10-18 12:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_api', '0018_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['state', 'office', 'created_date'], name='order_state_office_created_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.1.1 on 2026-10-18 12:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_api', '0019_order_state_office_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='state_version',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Увеличивается при каждой смене состояния.'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'created_date'], name='order_user_created_idx'),
+        ),
+    ]
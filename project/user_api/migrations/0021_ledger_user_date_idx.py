@@ -0,0 +1,21 @@
+# Generated by Django 4.1.1 on 2026-10-18 12:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_api', '0020_order_state_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='balancereplenish',
+            index=models.Index(fields=['user', 'date'], name='replenish_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='balancewriteoff',
+            index=models.Index(fields=['user', 'date'], name='write_off_user_date_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.1.1 on 2026-10-18 12:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_api', '0021_ledger_user_date_idx'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='customer',
+            constraint=models.CheckConstraint(check=models.Q(('balance__gte', 0)), name='customer_balance_non_negative'),
+        ),
+    ]
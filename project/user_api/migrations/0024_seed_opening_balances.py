@@ -0,0 +1,13 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """Начальные балансы больше не записываются миграцией: расхождения между балансом и историей
+    записываются явно командой reconcile_balances --seed-opening-balances --admin <id> с отчётом
+    по каждому пользователю (--dry-run - только показать)"""
+
+    dependencies = [
+        ('user_api', '0023_balance_reconciliation'),
+    ]
+
+    operations = []
@@ -0,0 +1,17 @@
+# Generated by Django 4.1.1 on 2026-10-18 12:24
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_api', '0024_seed_opening_balances'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='customer',
+            name='customer_balance_non_negative',
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
+from django.db.models import UniqueConstraint, Index, F
 from django.contrib.auth.models import User
 from io import BytesIO
 
@@ -9,9 +10,22 @@ from rest_framework.renderers import JSONRenderer
 import hashlib
 from django.contrib.auth.backends import ModelBackend
 
+from . import order_cache
+
+
+class CustomerQuerySet(models.QuerySet):
+    def increase_balance(self, delta):
+        return self.update(balance=F("balance") + delta)
+
+    def decrease_balance(self, delta):
+        """Списывает delta только у тех, у кого хватает баланса, возвращает число изменённых строк"""
+        return self.filter(balance__gte=delta).update(balance=F("balance") - delta)
+
 
 # Изменить название на UserInfo
 class Customer(models.Model):
+    objects = CustomerQuerySet.as_manager()
+
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     first_name = models.CharField(max_length=100, null=False, blank=False)
     last_name = models.CharField(max_length=100, null=False, blank=False)
@@ -31,21 +45,8 @@ class Customer(models.Model):
         verbose_name = "Покупатель"
         verbose_name_plural = "Покупатели"
 
-    def increase_balance(self, delta: int):
-        self.balance += delta
-        self.save()
-
-    def decrease_balance(self, delta: int):
-        if self.balance < delta:
-            raise ValidationError("User balance must not be negative")
-        self.balance -= delta
-        self.save()
-
     def cart_total_count(self):
-        return sum([c.price() * c.count for c in self.user.productcart_set.all()])
-
-    def clear_cart(self):
-        return self.user.productcart_set.all().delete()
+        return self.user.productcart_set.summary()["total"]
 
     def grant_admin_permissions(self):
         self.admin_permissions = True
@@ -67,22 +68,28 @@ class Customer(models.Model):
     def get_balance_write_offs_history(self):
         return [bwo for bwo in self.user.balancewriteoff_set.all().order_by("-date")]
 
-    def extract_cart(self):
-        return [
-            {
-                "product_id": c.product_id(),
-                "name": c.name(),
-                "type": c.type(),
-                "item_size": c.item_size(),
-                "photo": c.photo(),
-                "price": c.price(),
-                "count": c.count,
-                "theme": c.theme(),
-            } for c in self.user.productcart_set.all()
-        ]
+
+class OrderQuerySet(models.QuerySet):
+    def for_admin(self):
+        """Заказы с покупателем одним join и позициями одним запросом, для OrderAdminSerializer"""
+        return self.select_related("user__customer").prefetch_related("orderline_set")
+
+    def set_state(self, state_):
+        """Переводит заказы в состояние одним UPDATE, заказы, которые уже в нём, не меняются.
+        Возвращает id обновлённых и пропущенных заказов"""
+        with transaction.atomic():
+            rows = self.select_for_update().order_by("id").values_list("id", "state", "state_version")
+            states = {pk: state for pk, state, _ in rows}
+            updated = [pk for pk, state in states.items() if state != state_]
+            if updated:
+                self.model.objects.filter(id__in=updated).update(state=state_, state_version=F("state_version") + 1)
+                order_cache.invalidate({pk: version + 1 for pk, state, version in rows if state != state_})
+        return updated, [pk for pk, state in states.items() if state == state_]
 
 
 class Order(models.Model):
+    objects = OrderQuerySet.as_manager()
+
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     product_list = models.BinaryField(null=False, blank=False)
 
@@ -103,13 +110,26 @@ class Order(models.Model):
                              default=OrderStateChoice.accepted, null=False, blank=False)
 
     created_date = models.DateTimeField(auto_now_add=True)
+    total = models.PositiveIntegerField(default=0, help_text="Сумма заказа на момент оформления.")
+    state_version = models.PositiveIntegerField(default=0, editable=False,
+                                                help_text="Увеличивается при каждой смене состояния.")
 
     class Meta:
         verbose_name = "Заказ"
         verbose_name_plural = "Заказы"
         ordering = ['-created_date']
+        indexes = [
+            # Очередь заказов в админ панели: фильтр по состоянию и офису, сортировка по дате
+            Index(fields=["state", "office", "created_date"], name="order_state_office_created_idx"),
+            # Заказы пользователя по дате
+            Index(fields=["user", "created_date"], name="order_user_created_idx"),
+        ]
 
     def products(self):
+        lines = self.orderline_set.all()
+        if lines:
+            return [line.as_dict() for line in lines]
+        # Заказы, позиции которых ещё не перенесены из product_list
         return JSONParser().parse(BytesIO(self.product_list))
 
     def user_name(self):
@@ -121,11 +141,73 @@ class Order(models.Model):
         if state_ not in self.OrderStateChoice.values:
             return
         self.state = state_
-        self.save()
+        # Версия увеличивается в базе, чтобы параллельные смены состояния не получили одну версию
+        self.state_version = F("state_version") + 1
+        self.save(update_fields=["state", "state_version"])
+        self.refresh_from_db(fields=["state_version"])
+        order_cache.invalidate({self.id: self.state_version})
+
+    @staticmethod
+    def list_total(list_):
+        return sum(item["count"] * item["price"] for item in list_)
+
+    @classmethod
+    def create_with_lines(cls, user_id, office, payment_method, list_):
+        """Создаёт заказ сразу со списком товаров и суммой: один insert заказа и один insert позиций"""
+        order = cls.objects.create(
+            user_id=user_id,
+            office=office,
+            payment_method=payment_method,
+            product_list=JSONRenderer().render(list_),
+            total=cls.list_total(list_),
+        )
+        OrderLine.objects.bulk_create([OrderLine.from_dict(order, item) for item in list_])
+        return order
+
+
+class OrderLine(models.Model):
+    order = models.ForeignKey(Order, on_delete=models.CASCADE)
+    # Без ограничения внешнего ключа, чтобы позиция сохраняла id товара и после его удаления
+    product = models.ForeignKey("store.Product", null=True, blank=True, db_constraint=False,
+                                on_delete=models.DO_NOTHING)
+    name = models.CharField(max_length=50, null=False, blank=False)
+    type = models.CharField(max_length=100, null=False, blank=False)
+    item_size = models.CharField(max_length=5, null=True, blank=True, default=None)
+    photo = models.CharField(max_length=255, null=False, blank=True, default="")
+    price = models.PositiveIntegerField()
+    count = models.PositiveSmallIntegerField()
+    theme = models.CharField(max_length=4, null=False, blank=False)
 
-    def set_product_list(self, list_):
-        self.product_list = JSONRenderer().render(list_)
-        self.save()
+    class Meta:
+        verbose_name = "Позиция заказа"
+        verbose_name_plural = "Позиции заказов"
+        ordering = ["id"]
+
+    @classmethod
+    def from_dict(cls, order, item):
+        return cls(
+            order=order,
+            product_id=item["product_id"],
+            name=item["name"],
+            type=item["type"],
+            item_size=item["item_size"],
+            photo=item["photo"],
+            price=item["price"],
+            count=item["count"],
+            theme=item["theme"],
+        )
+
+    def as_dict(self):
+        return {
+            "product_id": self.product_id,
+            "name": self.name,
+            "type": self.type,
+            "item_size": self.item_size,
+            "photo": self.photo,
+            "price": self.price,
+            "count": self.count,
+            "theme": self.theme,
+        }
 
 
 class BalanceReplenish(models.Model):
@@ -138,13 +220,20 @@ class BalanceReplenish(models.Model):
     class Meta:
         verbose_name = "Пополнение баланса"
         verbose_name_plural = "История ополнений балансов"
+        indexes = [
+            Index(fields=["user", "date"], name="replenish_user_date_idx"),
+        ]
 
     def __str__(self):
         return f"Пополнение счёта пользователя {self.user.customer.first_name} на {self.count}"
 
     def save(self, *args, **kwargs):
-        self.user.customer.increase_balance(self.count)
-        super(BalanceReplenish, self).save(*args, **kwargs)
+        # Баланс меняется только при создании записи и в одной транзакции с ней
+        if not self._state.adding:
+            return super(BalanceReplenish, self).save(*args, **kwargs)
+        with transaction.atomic():
+            Customer.objects.filter(user_id=self.user_id).increase_balance(self.count)
+            super(BalanceReplenish, self).save(*args, **kwargs)
 
 
 class BalanceWriteOff(models.Model):
@@ -157,13 +246,46 @@ class BalanceWriteOff(models.Model):
     class Meta:
         verbose_name = "Списание баланса"
         verbose_name_plural = "История списания балансов"
+        indexes = [
+            Index(fields=["user", "date"], name="write_off_user_date_idx"),
+        ]
 
     def __str__(self):
         return f"Списания счёта пользователя {self.user.customer.first_name} на {self.count}"
 
     def save(self, *args, **kwargs):
-        self.user.customer.decrease_balance(self.count)
-        super(BalanceWriteOff, self).save(*args, **kwargs)
+        # Баланс меняется только при создании записи и в одной транзакции с ней
+        if not self._state.adding:
+            return super(BalanceWriteOff, self).save(*args, **kwargs)
+        with transaction.atomic():
+            if not Customer.objects.filter(user_id=self.user_id).decrease_balance(self.count):
+                raise ValidationError("User balance must not be negative")
+            super(BalanceWriteOff, self).save(*args, **kwargs)
+
+
+class BalanceCheckpoint(models.Model):
+    """Последние записи истории баланса, учтённые сверкой балансов (одна строка)"""
+    last_replenish_id = models.PositiveBigIntegerField(default=0)
+    last_write_off_id = models.PositiveBigIntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Контрольная точка сверки балансов"
+        verbose_name_plural = "Контрольные точки сверки балансов"
+
+    @classmethod
+    def get(cls):
+        return cls.objects.get_or_create(id=1)[0]
+
+
+class BalanceLedgerTotal(models.Model):
+    """Сумма пополнений за вычетом списаний пользователя до контрольной точки сверки"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE)
+    total = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Итог истории баланса"
+        verbose_name_plural = "Итоги истории балансов"
 
 
 class SecretWord(models.Model):
@@ -185,3 +307,38 @@ class SecretWord(models.Model):
     def save(self, *args, **kwargs):
         self.word = hashlib.sha256(self.word.encode()).hexdigest()
         super(SecretWord, self).save(*args, **kwargs)
+
+
+class IdempotencyKey(models.Model):
+    """Сохранённый ответ на запрос с заголовком Idempotency-Key"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    key = models.CharField(max_length=255, null=False, blank=False)
+    path = models.CharField(max_length=255, null=False, blank=False)
+    fingerprint = models.CharField(max_length=64, null=False, blank=False, help_text="Хэш тела запроса.")
+
+    class StateChoice(models.TextChoices):
+        in_progress = "in_progress"
+        completed = "completed"
+
+    state = models.CharField(max_length=len(StateChoice.in_progress), choices=StateChoice.choices,
+                             default=StateChoice.in_progress, null=False, blank=False)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True, default=None)
+    response_data = models.BinaryField(null=True, blank=True, default=None)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Ключ идемпотентности"
+        verbose_name_plural = "Ключи идемпотентности"
+        constraints = [
+            UniqueConstraint(fields=["user", "key"], name="idempotency_key_unique"),
+        ]
+
+    def complete(self, response):
+        self.state = self.StateChoice.completed
+        self.status_code = response.status_code
+        self.response_data = JSONRenderer().render(response.data)
+        self.save(update_fields=["state", "status_code", "response_data"])
+
+    def response(self):
+        data = JSONParser().parse(BytesIO(self.response_data)) if self.response_data else None
+        return data, self.status_code
@@ -0,0 +1,35 @@
+"""Кэш отрендеренных ответов get_order.
+
+Запись хранит версию состояния заказа (Order.state_version) и тело ответа. Тело отдаётся,
+только если его версия совпадает с версией заказа в базе, которую get_order читает одним
+запросом по первичному ключу, поэтому процесс с локальным кэшем (LocMemCache) не отдаст
+ответ для заказа, который изменил или отменил другой процесс.
+
+При смене состояния или отмене заказа запись в своём процессе заменяется пустой записью
+с новой версией, чтобы устаревшее тело не занимало кэш до истечения ORDER_TTL."""
+from django.core.cache import cache
+from django.db import transaction
+
+ORDER_KEY = "order:{pk}"
+ORDER_TTL = 60 * 60 * 24
+
+
+def get_body(pk, version):
+    """Тело ответа для заказа с данной версией состояния или None"""
+    entry = cache.get(ORDER_KEY.format(pk=pk))
+    if entry is None or entry["version"] != version:
+        return None
+    return entry["body"]
+
+
+def store_body(order, body):
+    key = ORDER_KEY.format(pk=order.id)
+    entry = cache.get(key)
+    if entry is None or entry["version"] <= order.state_version:
+        cache.set(key, {"version": order.state_version, "body": body}, ORDER_TTL)
+
+
+def invalidate(versions):
+    """versions - {id заказа: новая версия состояния}, применяется после коммита транзакции"""
+    entries = {ORDER_KEY.format(pk=pk): {"version": version, "body": None} for pk, version in versions.items()}
+    transaction.on_commit(lambda: cache.set_many(entries, ORDER_TTL))
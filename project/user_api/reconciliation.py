@@ -0,0 +1,127 @@
+"""Сверка Customer.balance с историей пополнений и списаний.
+
+Итог истории по каждому пользователю хранится в BalanceLedgerTotal, а id последних учтённых
+записей - в BalanceCheckpoint, поэтому очередной запуск агрегирует только новые записи истории.
+Записи моложе LAG не учитываются: транзакция с меньшим id может закоммититься позже большего."""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Sum, Max, OuterRef, Subquery, Value, F
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Customer, BalanceReplenish, BalanceWriteOff, BalanceCheckpoint, BalanceLedgerTotal
+
+LAG = timedelta(minutes=5)
+
+
+def _upper_id(model, last_id, before):
+    upper = model.objects.filter(id__gt=last_id, date__lt=before).aggregate(upper=Max("id"))["upper"]
+    return upper or last_id
+
+
+def _sums(model, last_id, upper_id):
+    return dict(model.objects.filter(id__gt=last_id, id__lte=upper_id)
+                .values("user_id").annotate(total=Sum("count")).order_by().values_list("user_id", "total"))
+
+
+def _pending_users(replenish_upper, write_off_upper, user_ids=None):
+    """Пользователи с ещё не учтёнными записями: их баланс уже мог измениться"""
+    pending = set()
+    for model, upper_id in ((BalanceReplenish, replenish_upper), (BalanceWriteOff, write_off_upper)):
+        rows = model.objects.filter(id__gt=upper_id)
+        if user_ids is not None:
+            rows = rows.filter(user_id__in=user_ids)
+        pending.update(rows.values_list("user_id", flat=True).distinct())
+    return pending
+
+
+def advance(full=False):
+    """Добавляет к итогам записи истории после контрольной точки, full=True пересчитывает итоги с нуля.
+    Возвращает число пользователей, чьи итоги изменились, и id новых контрольных записей"""
+    with transaction.atomic():
+        BalanceCheckpoint.get()
+        checkpoint = BalanceCheckpoint.objects.select_for_update().get(id=1)
+
+        if full:
+            BalanceLedgerTotal.objects.all().delete()
+            checkpoint.last_replenish_id = checkpoint.last_write_off_id = 0
+
+        before = timezone.now() - LAG
+        replenish_upper = _upper_id(BalanceReplenish, checkpoint.last_replenish_id, before)
+        write_off_upper = _upper_id(BalanceWriteOff, checkpoint.last_write_off_id, before)
+
+        deltas = _sums(BalanceReplenish, checkpoint.last_replenish_id, replenish_upper)
+        for user_id, total in _sums(BalanceWriteOff, checkpoint.last_write_off_id, write_off_upper).items():
+            deltas[user_id] = deltas.get(user_id, 0) - total
+
+        totals = {t.user_id: t for t in BalanceLedgerTotal.objects.filter(user_id__in=deltas)}
+        for user_id, delta in deltas.items():
+            if user_id in totals:
+                totals[user_id].total += delta
+        BalanceLedgerTotal.objects.bulk_update(totals.values(), ["total"], batch_size=500)
+        BalanceLedgerTotal.objects.bulk_create([
+            BalanceLedgerTotal(user_id=user_id, total=delta) for user_id, delta in deltas.items() if user_id not in totals
+        ], batch_size=500)
+
+        checkpoint.last_replenish_id = replenish_upper
+        checkpoint.last_write_off_id = write_off_upper
+        checkpoint.save()
+
+    return len(deltas), replenish_upper, write_off_upper
+
+
+def mismatches(replenish_upper, write_off_upper):
+    """Покупатели, чей баланс не совпадает с итогом истории, в виде (user_id, баланс, итог).
+    Итог None - у пользователя нет ни одной записи истории, сверять баланс не с чем"""
+    ledger = BalanceLedgerTotal.objects.filter(user_id=OuterRef("user_id")).values("total")
+    rows = Customer.objects.annotate(ledger=Subquery(ledger)) \
+        .exclude(balance=Coalesce(F("ledger"), Value(0))).order_by("user_id") \
+        .values_list("user_id", "balance", "ledger")
+
+    pending = _pending_users(replenish_upper, write_off_upper)
+    return [row for row in rows if row[0] not in pending]
+
+
+def repair(rows, replenish_upper, write_off_upper):
+    """Выставляет балансы по итогам истории одним bulk_update, возвращает исправленные строки.
+    Пропускаются пользователи без истории (баланс не с чем сверить) и с отрицательным итогом"""
+    ledger = {user_id: total for user_id, _, total in rows if total is not None and total >= 0}
+
+    with transaction.atomic():
+        customers = list(Customer.objects.select_for_update().filter(user_id__in=ledger))
+        # Пока баланс заблокирован, новых записей истории не появится, но они могли появиться до блокировки
+        pending = _pending_users(replenish_upper, write_off_upper, list(ledger))
+        customers = [customer for customer in customers if customer.user_id not in pending]
+        for customer in customers:
+            customer.balance = ledger[customer.user_id]
+        Customer.objects.bulk_update(customers, ["balance"], batch_size=500)
+
+    repaired = {customer.user_id for customer in customers}
+    return [row for row in rows if row[0] in repaired]
+
+
+def seed_opening_balances(rows, admin_id, replenish_upper, write_off_upper, comment="Начальный баланс"):
+    """Записывает в историю разницу между балансом и итогом истории от имени admin_id,
+    чтобы история объясняла текущий баланс. Баланс не меняется: записи создаются через bulk_create.
+    Возвращает записанные строки вида (user_id, разница)"""
+    diffs = {user_id: balance - (total or 0) for user_id, balance, total in rows}
+
+    with transaction.atomic():
+        customers = Customer.objects.select_for_update().filter(user_id__in=diffs)
+        # Балансы и итоги могли измениться после сверки: такие пользователи пропускаются
+        pending = _pending_users(replenish_upper, write_off_upper, list(diffs))
+        locked = {customer.user_id: customer.balance for customer in customers if customer.user_id not in pending}
+        seeded = [(user_id, diff) for user_id, balance, _ in rows
+                  if locked.get(user_id) == balance and (diff := diffs[user_id])]
+
+        BalanceReplenish.objects.bulk_create([
+            BalanceReplenish(user_id=user_id, admin_id=admin_id, count=diff, comment=comment)
+            for user_id, diff in seeded if diff > 0
+        ], batch_size=500)
+        BalanceWriteOff.objects.bulk_create([
+            BalanceWriteOff(user_id=user_id, admin_id=admin_id, count=-diff, comment=comment)
+            for user_id, diff in seeded if diff < 0
+        ], batch_size=500)
+
+    return seeded
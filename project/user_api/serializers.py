@@ -15,12 +15,6 @@ class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
         return token
 
 
-class OrderPureSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Order
-        fields = "__all__"
-
-
 class OrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
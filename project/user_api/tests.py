@@ -1,3 +1,130 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import F
 from django.test import TestCase
+from rest_framework.test import APIClient
+
+from .models import Customer, BalanceReplenish, BalanceWriteOff, IdempotencyKey
+from .serializers import BalanceReplenishPureSerializer
+
 
 # Create your tests here.
+def create_customer(username, balance=0, admin=False):
+    user = User.objects.create(username=username)
+    Customer.objects.create(user=user, first_name="Иван", last_name="Иванов", patronymic="Иванович",
+                            balance=balance, admin_permissions=admin)
+    return user
+
+
+class IdempotencyTest(TestCase):
+    def setUp(self):
+        self.customer = create_customer("customer", balance=100)
+        self.client = APIClient()
+        self.client.force_authenticate(create_customer("admin", admin=True))
+
+    def change_balance(self, key, new_balance="150"):
+        return self.client.post("/service-admin/balance-changes/",
+                                {"userId": self.customer.id, "newBalance": new_balance, "comment": "Премия"},
+                                format="json", HTTP_IDEMPOTENCY_KEY=key)
+
+    def balance(self):
+        return Customer.objects.get(user=self.customer).balance
+
+    def test_repeated_request_replays_response(self):
+        first = self.change_balance("key-1")
+        second = self.change_balance("key-1")
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second.headers["Idempotent-Replayed"], "true")
+        self.assertEqual(BalanceReplenish.objects.filter(user=self.customer).count(), 1)
+        self.assertEqual(self.balance(), 150)
+
+    def test_reused_key_with_another_body_is_rejected(self):
+        self.change_balance("key-1")
+        response = self.change_balance("key-1", new_balance="200")
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(self.balance(), 150)
+
+    def test_key_is_released_on_server_error(self):
+        with mock.patch.object(BalanceReplenishPureSerializer, "is_valid", return_value=False), \
+                mock.patch.object(BalanceReplenishPureSerializer, "errors", {"count": ["Error."]}):
+            response = self.change_balance("key-1")
+
+        self.assertEqual(response.status_code, 500)
+        self.assertFalse(IdempotencyKey.objects.filter(key="key-1").exists())
+
+        response = self.change_balance("key-1")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("Idempotent-Replayed", response.headers)
+        self.assertEqual(self.balance(), 150)
+
+
+class BulkAccrualTest(TestCase):
+    def setUp(self):
+        self.first = create_customer("first", balance=100)
+        self.second = create_customer("second", balance=10)
+        self.client = APIClient()
+        self.client.force_authenticate(create_customer("admin", admin=True))
+
+    def test_report_has_a_row_per_change(self):
+        response = self.client.post("/service-admin/balance-changes/bulk/", {"changes": [
+            {"userId": self.first.id, "delta": 50, "comment": "Премия"},
+            {"userId": self.second.id, "delta": -20, "comment": "Штраф"},
+            {"userId": 999999, "delta": 10, "comment": "Премия"},
+            {"userId": self.first.id, "delta": 0, "comment": "Премия"},
+            {"userId": self.first.id, "delta": -150, "comment": "Покупка"},
+        ]}, format="json")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["applied"], 2)
+        self.assertEqual(response.data["failed"], 3)
+        self.assertEqual(response.data["results"], [
+            {"index": 0, "userId": self.first.id, "balance": 150},
+            {"index": 1, "userId": self.second.id, "error": "Not enough ucoins"},
+            {"index": 2, "userId": 999999, "error": "Desired user_id does not exist."},
+            {"index": 3, "userId": self.first.id, "error": "Delta must be a non-zero integer."},
+            {"index": 4, "userId": self.first.id, "balance": 0},
+        ])
+
+        # Каждая применённая строка записана в историю, баланс меняется на сумму строк
+        self.assertEqual(Customer.objects.get(user=self.first).balance, 0)
+        self.assertEqual(Customer.objects.get(user=self.second).balance, 10)
+        self.assertEqual(BalanceReplenish.objects.filter(user=self.first).count(), 1)
+        self.assertEqual(BalanceWriteOff.objects.filter(user=self.first).count(), 1)
+        self.assertFalse(BalanceWriteOff.objects.filter(user=self.second).exists())
+
+
+class BalanceTest(TestCase):
+    def setUp(self):
+        self.customer = create_customer("customer", balance=100)
+        self.customers = Customer.objects.filter(user=self.customer)
+
+    def balance(self):
+        return self.customers.get().balance
+
+    def test_conditional_debit_refuses_overdraft(self):
+        self.assertEqual(self.customers.decrease_balance(150), 0)
+        self.assertEqual(self.balance(), 100)
+
+        self.assertEqual(self.customers.decrease_balance(100), 1)
+        self.assertEqual(self.balance(), 0)
+
+    def test_write_off_over_balance_is_not_recorded(self):
+        with self.assertRaises(ValidationError):
+            BalanceWriteOff(user=self.customer, admin_id=self.customer.id, count=150, comment="Покупка").save()
+
+        self.assertEqual(self.balance(), 100)
+        self.assertFalse(BalanceWriteOff.objects.exists())
+
+    def test_balance_can_not_become_negative(self):
+        # Проверка баланса в базе срабатывает и для UPDATE в обход decrease_balance
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.customers.update(balance=F("balance") - 150)
+
+        self.assertEqual(self.balance(), 100)
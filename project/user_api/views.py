@@ -1,14 +1,26 @@
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Q, Count, Sum
+from django.http import HttpResponse
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 
-from .models import Order, Customer, User, SecretWord
-from .serializers import MyTokenObtainPairSerializer, OrderPureSerializer, \
+from project.pagination import is_paginated, paginate, PaginationError
+from store.models import ProductCart
+from .filters import parse_filters, apply_filters, FilterError
+from .history import balance_history
+from . import order_cache
+from .accruals import apply_changes, AccrualError
+from .idempotency import idempotent
+from .models import Order, Customer, User, SecretWord, BalanceReplenish, BalanceWriteOff
+from .serializers import MyTokenObtainPairSerializer, \
     OrderSerializer, OrderAdminSerializer, UserPublicInfoSerializer, UserPureSerializer, CustomerPureSerializer, \
     BalanceWriteOffPureSerializer, BalanceReplenishPureSerializer
 
+MAX_BULK_ORDERS = 1000
+
 
 # Create your views here.
 class MyTokenObtainPairView(TokenObtainPairView):
@@ -18,6 +30,7 @@ class MyTokenObtainPairView(TokenObtainPairView):
 
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
+@idempotent
 def create_order(request):
     """Формирует заказ пользователя"""
     office_ = request.data.get("office")
@@ -32,62 +45,148 @@ def create_order(request):
     if payment_method not in ["rubles", "ucoins"]:
         return Response({'error': "Not valid payment method."}, status=400)
 
-    # Проверяет, что в корзине пользователя существуют item's
-    if not len(request.user.productcart_set.all()):
-        return Response({"error": "User's cart does not have any item."}, status=500)
-
-    # Если метод оплаты - юкоины, то списывает деньги со счёта
-    if payment_method == "ucoins":
-        total_count = request.user.customer.cart_total_count()
-        if total_count > request.user.customer.balance:
-            return Response({"error": "Not enough ucoins"}, status=400)
-        serializer = BalanceWriteOffPureSerializer(data={
-            "user": request.user.id,
-            "admin_id": request.user.id,
-            "comment": "Покупка мерча",
-            "count": total_count
-        })
+    office_max_length = Order._meta.get_field("office").max_length
+    if not isinstance(office_, str) or not office_.strip() or len(office_) > office_max_length:
+        return Response({"error": "Not valid office."}, status=400)
 
-        if serializer.is_valid():
-            serializer.save()
+    # Вся покупка - одна транзакция: списание, заказ и очистка корзины применяются вместе или не применяются вовсе
+    with transaction.atomic():
+        # Снимок корзины, блокировка строк не даёт параллельному оформлению купить те же позиции второй раз
+        cart = list(request.user.productcart_set.for_display().select_for_update(of=("self",)))
 
-    request.data["payment_method"] = payment_method
-    request.data['user'] = request.user.id
+        # Проверяет, что в корзине пользователя существуют item's
+        if not cart:
+            return Response({"error": "User's cart does not have any item."}, status=500)
 
-    serializer = OrderPureSerializer(data=request.data)
+        product_list = [c.order_item() for c in cart]
+        total_count = Order.list_total(product_list)
 
-    if serializer.is_valid():
-        order = serializer.save()
-        order.set_product_list(request.user.customer.extract_cart())
-        request.user.customer.clear_cart()
-        return Response(OrderSerializer(order, many=False).data)
-    return Response(serializer.errors, status=500)
+        # Если метод оплаты - юкоины, то списывает деньги со счёта условным UPDATE,
+        # поэтому две одновременные покупки не могут увести баланс в минус
+        if payment_method == "ucoins":
+            if not Customer.objects.filter(user_id=request.user.id).decrease_balance(total_count):
+                return Response({"error": "Not enough ucoins"}, status=400)
+
+            # bulk_create не вызывает save(), который списал бы баланс ещё раз
+            BalanceWriteOff.objects.bulk_create([BalanceWriteOff(
+                user_id=request.user.id,
+                admin_id=request.user.id,
+                comment="Покупка мерча",
+                count=total_count,
+            )])
+
+        order = Order.create_with_lines(request.user.id, office_, payment_method, product_list)
+
+        # Удаляются только позиции из снимка, добавленные после него остаются в корзине
+        ProductCart.objects.filter(id__in=[c.id for c in cart]).delete()
+
+    return Response(OrderSerializer(order, many=False).data)
 
 
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def get_order(request, pk):
-    """Метод возвращает определенный заказ по его ключу"""
-    order = Order.objects.filter(id=pk)
+    """Метод возвращает определенный заказ по его ключу, ответ берётся из кэша, пока не сменится состояние"""
+    if not pk.isdigit():
+        return Response({"error": "Desired order does not exist."}, status=400)
+
+    version = Order.objects.filter(id=pk).values_list("state_version", flat=True).first()
 
     # Проверяет, существует ли искомый по ключу заказ
-    if not order.exists():
+    if version is None:
         return Response({"error": "Desired order does not exist."}, status=400)
 
-    return Response(OrderSerializer(order.first()).data)
+    body = order_cache.get_body(pk, version)
+
+    if body is None:
+        order = Order.objects.filter(id=pk).prefetch_related("orderline_set").first()
+
+        # Заказ отменили между запросами
+        if order is None:
+            return Response({"error": "Desired order does not exist."}, status=400)
+
+        body = JSONRenderer().render(OrderSerializer(order).data)
+        order_cache.store_body(order, body)
+
+    return HttpResponse(body, content_type="application/json")
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def get_user_orders(request):
+    """Метод возвращает заказы пользователя, новые первыми, постранично
+    cursor, limit - параметры постраничной выдачи вида {"results": [...], "next": курсор}"""
+    orders = request.user.order_set.prefetch_related("orderline_set")
+
+    try:
+        page, next_cursor = paginate(orders, ["-created_date", "-id"], request)
+    except PaginationError as err:
+        return Response({"error": str(err)}, status=400)
+
+    return Response({"results": OrderSerializer(page, many=True).data, "next": next_cursor})
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def get_balance_history(request):
+    """Метод возвращает пополнения и списания баланса пользователя одной лентой, новые первыми
+    cursor, limit - параметры постраничной выдачи вида {"results": [...], "next": курсор}"""
+    try:
+        page, next_cursor = balance_history(request.user, request)
+    except PaginationError as err:
+        return Response({"error": str(err)}, status=400)
+
+    return Response({"results": page, "next": next_cursor})
 
 
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def get_orders_admin(request):
-    """Метод вовзращает список всех заказов в админ панель"""
+    """Метод вовзращает список всех заказов в админ панель
+    office, paymentMethod, dateFrom, dateTo (YYYY-MM-DD) - фильтры очереди
+    cursor, limit - включают постраничную выдачу вида {"results": [...], "next": курсор}"""
 
     # Проверяет, достаточно ли у пользователя прав для данного действия
     if not request.user.customer.admin_permissions:
         return Response({"error": f"Not enough rights."}, status=403)
 
-    return Response(OrderAdminSerializer(
-        Order.objects.filter(state="Accepted"), many=True).data)
+    try:
+        filters = parse_filters(request.GET)
+    except FilterError as err:
+        return Response({"error": str(err)}, status=400)
+
+    orders = apply_filters(Order.objects.filter(state="Accepted"), filters).for_admin()
+
+    if not is_paginated(request):
+        return Response(OrderAdminSerializer(orders, many=True).data)
+
+    try:
+        page, next_cursor = paginate(orders, ["-created_date", "-id"], request)
+    except PaginationError as err:
+        return Response({"error": str(err)}, status=400)
+
+    return Response({"results": OrderAdminSerializer(page, many=True).data, "next": next_cursor})
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def get_orders_by_office(request):
+    """Метод возвращает количество и сумму принятых заказов по офисам,
+    принимает те же фильтры, что и очередь заказов"""
+
+    # Проверяет, достаточно ли у пользователя прав для данного действия
+    if not request.user.customer.admin_permissions:
+        return Response({"error": "Not enough rights."}, status=403)
+
+    try:
+        filters = parse_filters(request.GET)
+    except FilterError as err:
+        return Response({"error": str(err)}, status=400)
+
+    offices = apply_filters(Order.objects.filter(state="Accepted"), filters) \
+        .values("office").annotate(count=Count("id"), total=Sum("total")).order_by("office")
+
+    return Response(list(offices))
 
 
 @api_view(["POST"])
@@ -114,6 +213,55 @@ def change_order_state(request, pk):
     return Response(OrderAdminSerializer(order).data, status=200)
 
 
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def change_orders_state(request):
+    """Метод меняет состояние набора заказов одним UPDATE.
+    Заказы задаются списком ids или фильтрами office, dateFrom, dateTo (YYYY-MM-DD).
+    Возвращает id обновлённых, пропущенных (уже в этом состоянии) и не найденных заказов"""
+
+    # Проверяет, достаточно ли у пользователя прав для данного действия
+    if not request.user.customer.admin_permissions:
+        return Response({"error": "Not enough rights."}, status=403)
+
+    state = request.data.get("state")
+
+    if state not in Order.OrderStateChoice.values:
+        return Response({"error": "Incorrect new state"}, status=400)
+
+    ids = request.data.get("ids")
+
+    if ids is not None:
+        if not isinstance(ids, list) or not ids or len(ids) > MAX_BULK_ORDERS:
+            return Response({"error": f"Ids must be a non-empty list of no more than {MAX_BULK_ORDERS} items."},
+                            status=400)
+        if not all(str(pk).isdigit() for pk in ids):
+            return Response({"error": "Order id must be integer field."}, status=400)
+
+        ids = list(dict.fromkeys(int(pk) for pk in ids))
+        orders = Order.objects.filter(id__in=ids)
+    else:
+        try:
+            filters = parse_filters(request.data)
+        except FilterError as err:
+            return Response({"error": str(err)}, status=400)
+
+        # Без условия запрос перевёл бы все заказы магазина
+        if not filters.keys() & {"office", "created_date__gte", "created_date__lt"}:
+            return Response({"error": "Ids or office/date filter is required."}, status=400)
+
+        orders = apply_filters(Order.objects.all(), filters)
+
+    updated, skipped = orders.set_state(state)
+    found = {*updated, *skipped}
+
+    return Response({
+        "updated": updated,
+        "skipped": skipped,
+        "notFound": [pk for pk in ids if pk not in found] if ids is not None else [],
+    })
+
+
 @api_view(["GET"])
 def user_search(request):
     """
@@ -180,6 +328,9 @@ def create_user(request):
     balance = request.data.get('balance')
     permission = request.data.get('permission')
 
+    if not str(balance).isdigit():
+        return Response({"error": "Invalid field: balance."}, status=400)
+
     # Create User Serializer
     username = "_".join([last_name, first_name, patronymic])
 
@@ -197,12 +348,18 @@ def create_user(request):
             "first_name": first_name,
             "last_name": last_name,
             "patronymic": patronymic,
-            "balance": balance,
             "admin_permissions": permission
         })
 
         if customer_serializer.is_valid():
             customer = customer_serializer.save()
+
+            # Начальный баланс начисляется записью в историю, чтобы баланс сходился с историей
+            if int(balance):
+                BalanceReplenish(user=user, admin_id=request.user.id, count=int(balance),
+                                 comment="Начальный баланс").save()
+                customer.refresh_from_db(fields=["balance"])
+
             return Response(UserPublicInfoSerializer(customer, many=False).data)
 
         # Response 500 if there are some error in customer serializer
@@ -214,6 +371,7 @@ def create_user(request):
 
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
+@idempotent
 def create_balance_changes(request):
     # Check requested user_id permission
     if not request.user.customer.admin_permissions:
@@ -265,6 +423,27 @@ def create_balance_changes(request):
     return Response(serializer.errors, status=500)
 
 
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+@idempotent
+def create_bulk_balance_changes(request):
+    """Метод начисляет и списывает юкоины списком строк {"userId", "delta", "comment"},
+    delta > 0 - начисление, delta < 0 - списание. Возвращает отчёт по каждой строке"""
+    if not request.user.customer.admin_permissions:
+        return Response({"error": "Not enough permissions."}, status=403)
+
+    try:
+        report = apply_changes(request.user, request.data.get("changes"))
+    except AccrualError as err:
+        return Response({"error": str(err)}, status=400)
+
+    return Response({
+        "results": report,
+        "applied": sum("error" not in row for row in report),
+        "failed": sum("error" in row for row in report),
+    })
+
+
 @api_view(["DELETE"])
 @permission_classes([IsAuthenticated])
 def delete_user(request, pk):
@@ -390,23 +569,24 @@ def order_cancellation(request):
     if order_id is None:
         return Response({"error": "OrderId parameter is missing."}, status=400)
 
-    order = Order.objects.filter(id=order_id).first()
+    order = Order.objects.filter(id=order_id).prefetch_related("orderline_set").first()
 
     if order is None:
         return Response({"error": "Desired order does not exists."}, status=400)
 
-    total_count = sum([item["count"] * item["price"] for item in order.products()])
-
     serializer = BalanceReplenishPureSerializer(data={
-        "user": order.user.id,
+        "user": order.user_id,
         "admin_id": request.user.id,
         "comment": f"Возврат средств из-за отмены заказа #{order_id}",
-        "count": total_count
+        "count": order.total
     })
 
     if serializer.is_valid():
         serializer.save()
+        # Ответ собирается до удаления: после него позиции заказа уже не прочитать
+        data = OrderAdminSerializer(order).data
         order.delete()
-        return Response(OrderAdminSerializer(order).data)
+        order_cache.invalidate({order_id: order.state_version + 1})
+        return Response(data)
 
     return Response(serializer.errors, status=500)